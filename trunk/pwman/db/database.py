@@ -6,8 +6,11 @@ should not be created directly but through DatabaseFactory.
 DatabaseNode contains the path. It can be either a password or a list.
 DatabaseData contains the data which is actually stored.
 """
+from __future__ import with_statement
 import os.path
+import bisect
 from pwman.util.crypto import CryptoEngine, CryptoNoKeyException
+from pwman.util.cache import LRUCache
 
 """Constants used to define the node types"""
 PW = 'PASSWORD'
@@ -52,37 +55,41 @@ class DatabaseListNotEmptyException(DatabaseNodeException):
     def __str__(self):
         return "DatabaseListNotEmptyException: %s (%s)" % (self.message, self.node)
     
-class DatabaseNode:
+class DatabaseNode(object):
     """
     DatabaseNode contains the path to a node, and its type.
     The type can be a password or a list.
+    Names are only encrypted or decrypted when first asked for, and
+    the path is kept once it has been worked out.
     """
+    __slots__ = ('_parent', '_type', '_name', '_cryptname', '_path',
+                 '__weakref__')
+
     def __init__(self, name, parent, type=PW, crypted=False):
         """Initialise a DatabaseNode instance.
         name is the name of the node. parent is another DatabaseNode.
         type is either PW or LIST. If it is neither a DatabaseException
         is raised.
         crypted specifies whether the name is ciphertext or plaintext.
-        Defaults to False"""
-        self._crypto = CryptoEngine.get()
+        Defaults to False."""
+        if (type != PW and type != LIST):
+            raise DatabaseInvalidNodeException(
+                "Trying to create an invalid node", None)
         self._parent = parent
+        self._type = type
+        self._path = None
         if (crypted == True):
             self._set_cryptedname(name)
         else:
             self._set_name(name)
-        if (type == PW or type == LIST):
-            self._type = type
-        else:
-            raise DatabaseInvalidNodeException(
-                "Trying to create an invalid node", None)
         
     def _set_name(self, name):
-        self._cryptname = self._crypto.encrypt(name)
         self._name = name
+        self._cryptname = None
 
     def _set_cryptedname(self, name):
         self._cryptname = name
-        self._name = self._crypto.decrypt(name)
+        self._name = None
         
     def get_parent(self):
         """Return the parent DatabaseNode."""
@@ -90,6 +97,8 @@ class DatabaseNode:
 
     def get_name(self):
         """Return the name of the node in plaintext form."""
+        if (self._name == None):
+            self._name = CryptoEngine.get().decrypt(self._cryptname)
         return self._name
 
     def get_type(self):
@@ -98,23 +107,102 @@ class DatabaseNode:
     
     def get_cryptedname(self):
         """Return the name of the node in ciphertext form."""
+        if (self._cryptname == None):
+            self._cryptname = CryptoEngine.get().encrypt(self._name)
         return self._cryptname
 
     def __str__(self):
         """Return a string representation of the node."""
-        if (self._parent == None):
-            return os.path.join("/", self._name)
+        if (self._path == None):
+            # work down from the closest ancestor which knows its path
+            nodes = []
+            node = self
+            while (node != None and node._path == None):
+                nodes.append(node)
+                node = node._parent
+            if (node == None):
+                path = ""
+            else:
+                path = node._path
+            nodes.reverse()
+            for node in nodes:
+                path = path + "/" + node.get_name()
+                node._path = path
+        return self._path
+
+class DatabaseHandle(DatabaseNode):
+    """
+    DatabaseHandle is a DatabaseNode returned by Database.open_node(),
+    which also carries the driver's id for the node.
+    """
+    __slots__ = ('_id',)
+
+    def __init__(self, node, id=None, type=None):
+        """Initialise a handle on the same node as the DatabaseNode
+        node. id is the driver's id for it. If type is given the
+        handle has that type rather than the type of node."""
+        self._parent = node._parent
+        if (type == None):
+            self._type = node._type
         else:
-            return os.path.join(self._parent.__str__(), self._name)
+            self._type = type
+        self._name = node._name
+        self._cryptname = node._cryptname
+        self._path = node._path
+        self._id = id
+
+    def get_id(self):
+        """Return the driver's id for the node, or None if it
+        hasn't been looked up yet."""
+        return self._id
+
+class DatabaseStat(object):
+    """DatabaseStat describes a node, as returned by Database.stat()."""
+    __slots__ = ('_type', '_id', '_children', '_size', '_node')
+
+    def __init__(self, type, id, children, size, node):
+        """Initialise a DatabaseStat. type is PW or LIST, id the
+        driver's id for the node, children the number of nodes in it
+        if it is a list, size the size in bytes of its encrypted data
+        if it is a password, and node a DatabaseHandle on it, or None
+        for the root list."""
+        self._type = type
+        self._id = id
+        self._children = children
+        self._size = size
+        self._node = node
+
+    def get_type(self):
+        """Return the type of the node."""
+        return self._type
+
+    def get_id(self):
+        """Return the driver's id for the node."""
+        return self._id
+
+    def get_children(self):
+        """Return the number of nodes in a list, 0 for a password."""
+        return self._children
+
+    def get_size(self):
+        """Return the size of the encrypted data of a password,
+        0 for a list."""
+        return self._size
 
-class DatabaseData:
+    def get_node(self):
+        """Return a DatabaseHandle on the node, None for the root."""
+        return self._node
+
+class DatabaseData(object):
     """Database contains the data for a node. Only password nodes
     have data."""
+    __slots__ = ('_data', '_cryptdata', '_decrypted')
+
     def __init__(self, data, crypted=False):
         """Initialise a data instance. data can be any picklable object
         if crypted is false. If crypted is true, then data must be an
-        object thats been previously encrypted."""        
-        self._crypto = CryptoEngine.get()
+        object thats been previously encrypted. Either way it is only
+        encrypted or decrypted when first asked for."""
         if crypted == True:
             self._set_crypteddata(data)
         else:
@@ -123,21 +211,43 @@ class DatabaseData:
     def get_data(self):
         """getData() -> obj
         Return data obj in plaintext."""
+        if (not self._decrypted):
+            self._data = CryptoEngine.get().decrypt(self._cryptdata)
+            self._decrypted = True
         return self._data
 
     def get_crypteddata(self):
         """getCryptedData() -> ciphertext
         Return data obj in ciphertext."""
+        if (self._cryptdata == None):
+            self._cryptdata = CryptoEngine.get().encrypt(self._data)
         return self._cryptdata
 
     def _set_data(self, data):
         self._data = data
-        self._cryptdata = self._crypto.encrypt(data)
+        self._decrypted = True
+        self._cryptdata = None
 
     def _set_crypteddata(self, data):
         self._cryptdata = data
-        self._data = self._crypto.decrypt(data)
+        self._data = None
+        self._decrypted = False
         
+class DatabaseTransaction:
+    """Context manager returned by Database.transaction().
+    Commits the transaction on exit, or rolls it back if the block
+    raised an exception."""
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        self._db._begintransaction()
+        return self._db
+
+    def __exit__(self, type, value, traceback):
+        self._db._endtransaction(type == None)
+        return False
+
 class Database:
     """Database interface. Methods convert paths to
     DatabaseNodes and pass these to the driver implementations.
@@ -156,16 +266,60 @@ class Database:
     Database._exists(node)
     Database._loadkey()
     Database._savekey(key)
+    Database._begin()
+    Database._commit()
+    Database._rollback()
+
+    Drivers may also implement these, the defaults fall back
+    on the methods above:
+    Database._putmany(parent, pairs)
+    Database._getmany(parent, nodes)
+    Database._iterlist(node, batch)
+    Database._copytree(snode, dnode)
+    Database._move(snode, dnode)
+    Database._removetree(node)
+    Database._stat(node, types)
+    Database._count(node, recursive)
+    Database._du(node)
+    Database._compact()
+    Database._flush()
+    Database._backup(dest, pages, progress)
+    Database._backupsteps()
+
+    While a transaction is open, drivers must not commit
+    after each operation (see Database._intransaction()).
     """
 
     def __init__(self, params):
+        """Initialise the Database. The only generic param is
+        'nodecache' in the 'Database' section, the number of paths
+        whose nodes are kept to save encrypting their names again.
+        Defaults to 1000."""
         self._crypto = CryptoEngine.get(params)
+        try:
+            nodecache = int(params['Database']['nodecache'])
+        except KeyError:
+            nodecache = 1000
+        except ValueError, e:
+            raise DatabaseException("Invalid nodecache [%s]" % (e))
+        # maps (absolute path, type) to its DatabaseNode
+        self._nodecache = LRUCache(nodecache)
+        self._txdepth = 0
+        self._txfailed = False
+        # number of paths handled at once by put_many and get_many
+        self._batchsize = 500
+        # maps the path of a list to its contents sorted by list(),
+        # keyed by order. Dropped when the list changes.
+        self._listindex = LRUCache(16)
         self.changelist("/") # starts at root
     
     def open(self):
         """Open the database."""
         self._open()
         key = self._loadkey()
+        # cached nodes hold names encrypted with the old key
+        self._nodecache.clear()
+        self._listindex.clear()
         if (key != None):
             self._crypto.set_cryptedkey(key)
         else:
@@ -175,6 +329,7 @@ class Database:
         """Encrypt dataobj and put it into database under path."""
         node = self._buildnode(path)
         data = DatabaseData(dataobj)
+        self._changednode(node)
         self._put(node, data)
         
     def get(self, path):
@@ -183,50 +338,299 @@ class Database:
         data = self._get(node)
         return data.get_data()
         
+    def put_many(self, items):
+        """Encrypt and put many objects in one transaction. `items` is
+        an iterable of (path, dataobj) pairs. Nodes in the same list are
+        handed to the driver together so the list is only looked up
+        once."""
+        with self.transaction():
+            for chunk in self._chunks(items):
+                pairs = []
+                for (path, dataobj) in chunk:
+                    pairs.append((self._buildnode(path),
+                                  DatabaseData(dataobj)))
+                for (parent, indices) in self._groupbyparent(
+                    [node for (node, data) in pairs]):
+                    for i in indices:
+                        self._changednode(pairs[i][0])
+                    self._putmany(parent, [pairs[i] for i in indices])
+
+    def get_many(self, paths):
+        """Generator yielding the decrypted data of each path in
+        `paths`, in the same order. Nodes in the same list are fetched
+        from the driver together."""
+        for chunk in self._chunks(paths):
+            nodes = [self._buildnode(path) for path in chunk]
+            results = [None] * len(nodes)
+            for (parent, indices) in self._groupbyparent(nodes):
+                datalist = self._getmany(parent, [nodes[i] for i in indices])
+                for (i, data) in zip(indices, datalist):
+                    results[i] = data
+            for data in results:
+                yield data.get_data()
+
+    def _chunks(self, iterable):
+        """Split iterable into lists of at most self._batchsize items."""
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if (len(chunk) == self._batchsize):
+                yield chunk
+                chunk = []
+        if (len(chunk) > 0):
+            yield chunk
+
+    def _groupbyparent(self, nodes):
+        """Returns a list of (parent, indices) tuples grouping the
+        indices of nodes by the list they are in."""
+        groups = []
+        byparent = {}
+        for i in range(len(nodes)):
+            parent = nodes[i].get_parent()
+            key = str(parent)
+            if (not byparent.has_key(key)):
+                byparent[key] = (parent, [])
+                groups.append(byparent[key])
+            byparent[key][1].append(i)
+        return groups
+
     def delete(self, path):
         """Delete path and associated data from database."""
         node = self._buildnode(path)
+        self._changednode(node)
         self._delete(node)
         
     def close(self):
         """Close the database."""
+        self._listindex.clear()
         self._close()
 
     def makelist(self, path):
         """Make list 'path' in current list."""
         node = self._buildnode(path, LIST)
         if (not self._exists(node)):
+            self._changednode(node)
             self._makelist(node)
 
     def removelist(self, path, recursive=False):
         """Remove list 'path' from current list.
         Will raise DatabaseException if list not empty."""
-        node = self._buildnode(path, LIST)
-        # check if list has children
-        if (not self._listempty(node) and not recursive):
+        stat = self.stat(path, LIST)
+        if (stat == None):
+            raise DatabaseNoSuchNodeException("List does not exist", path)
+        node = stat.get_node()
+        if (node == None):
+            raise DatabaseInvalidNodeException("Cannot remove root list",
+                                               None)
+        if (stat.get_children() > 0 and not recursive):
             raise DatabaseListNotEmptyException(
                 "Cannot remove list", node)
         else:
-            self._recursive_removelist(node)
+            # the lists below it go too
+            self._listindex.clear()
+            with self.transaction():
+                self._removetree(node)
 
     def _recursive_removelist(self, node):
-        nodelist = self._list(node)
-        for i in nodelist:
-            if (i.get_type() == LIST):
-                self._recursive_removelist(i)
-            else:
-                self._delete(i)
-        self._removelist(node)
-        
-    def list(self, path=None):
+        with self.transaction():
+            for i in self._walk(node, 'post', 100):
+                if (i.get_type() == LIST):
+                    self._removelist(i)
+                else:
+                    self._delete(i)
+
+    def list(self, path=None, limit=None, after=None, order='name'):
         """Returns a array of DatabaseNode objects in list 'path'.
-        If path is None, list current."""
+        If path is None, list current.
+        With order 'name' the nodes are sorted by name, with 'type'
+        lists come before passwords and each are sorted by name.
+        At most `limit` nodes are returned. `after` is the last node
+        of the previous page, the list carries on from where that node
+        is, or would be if it has gone, so pages stay in step while
+        the list changes.
+        The sorted list is kept until the list changes, so names are
+        decrypted once rather than for every page."""
         if (path == None):
             node = self._clist
         else:
             node = self._buildnode(path, LIST)
-        return self._list(node)
+        (keys, nodes) = self._sortedlist(node, order)
+        start = 0
+        if (after != None):
+            start = bisect.bisect_right(keys, self._sortkey(after, order))
+        if (limit == None):
+            return nodes[start:]
+        return nodes[start:start+limit]
+
+    def _sortkey(self, node, order):
+        if (order == 'type'):
+            return (node.get_type() != LIST, node.get_name())
+        return (node.get_name(), node.get_type())
+
+    def _sortedlist(self, node, order):
+        """Returns (keys, nodes), the contents of list node sorted by
+        order and their sort keys, from the list index."""
+        if (order != 'name' and order != 'type'):
+            raise DatabaseException("Unknown list order '%s'" % (order))
+        path = self._listpath(node)
+        if (self._stalepath(node)):
+            # kept out of the index, it is keyed by path
+            index = {}
+        else:
+            index = self._listindex.get(path)
+        if (index == None):
+            index = {}
+            self._listindex.put(path, index)
+        if (not index.has_key(order)):
+            if (len(index) > 0):
+                # sorted the other way already, names are decrypted
+                nodes = index.values()[0][1]
+            else:
+                nodes = self._list(node)
+            pairs = [(self._sortkey(n, order), n) for n in nodes]
+            pairs.sort()
+            index[order] = ([key for (key, n) in pairs],
+                            [n for (key, n) in pairs])
+        return index[order]
+
+    def _changednode(self, node):
+        """Drop the list node is in from the list index, as node is
+        about to be added to it or removed from it."""
+        if (self._stalepath(node)):
+            self._listindex.clear()
+        else:
+            self._listindex.remove(self._listpath(node.get_parent()))
+
+    def _stalepath(self, node):
+        """Returns True if the path of node may be out of date, as it
+        is, or is below, a handle whose node may have been moved since.
+        The current list is kept up to date by move()."""
+        while (node != None and node is not self._clist):
+            if (isinstance(node, DatabaseHandle)):
+                return True
+            node = node.get_parent()
+        return False
+
+    def _listpath(self, node):
+        if (node == None):
+            return "/"
+        return str(node)
         
+    def count(self, path=None, recursive=False):
+        """Returns the number of nodes in list 'path', or if recursive
+        is True below it. If path is None, count the current list.
+        No names are decrypted."""
+        if (path == None):
+            node = self._clist
+        else:
+            node = self._buildnode(path, LIST)
+        return self._count(node, recursive)
+
+    def du(self, path=None):
+        """Returns the total size in bytes of the encrypted data of
+        the passwords below list 'path'. If path is None, add up the
+        current list. No data is decrypted."""
+        if (path == None):
+            node = self._clist
+        else:
+            node = self._buildnode(path, LIST)
+        return self._du(node)
+
+    def iterlist(self, path=None, batch=100):
+        """Returns an iterator over the DatabaseNode objects in list
+        'path'. If path is None, iterate over current list.
+        Nodes are fetched from the driver `batch` at a time and their
+        names are only decrypted when asked for, so long lists can be
+        walked without holding them in memory."""
+        if (path == None):
+            node = self._clist
+        else:
+            node = self._buildnode(path, LIST)
+        return self._iterlist(node, batch)
+
+    def walk(self, path=None, order='pre', batch=100):
+        """Generator yielding the DatabaseNode objects below list
+        'path', and the list itself unless it is the root. If path is
+        None, walk the current list.
+        With order 'pre' each list comes before its contents, with
+        'post' after them, so a list's contents can be removed before
+        the list itself. Nodes are fetched from the driver `batch` at
+        a time. The tree is walked with a stack rather than recursion,
+        so there is no limit on its depth."""
+        if (path == None):
+            node = self._clist
+        else:
+            node = self._buildnode(path, LIST)
+        return self._walk(node, order, batch)
+
+    def _walk(self, node, order, batch):
+        if (order != 'pre' and order != 'post'):
+            raise DatabaseException("Unknown walk order '%s'" % (order))
+        if (order == 'pre' and node != None):
+            yield node
+        # each frame is [list, iterator over its children, whether the
+        # iterator has been read into memory]. Only the frame on top
+        # streams from the driver, the rest of a list is read in before
+        # descending into one of its sublists.
+        stack = [[node, self._iterlist(node, batch), False]]
+        while (len(stack) > 0):
+            frame = stack[-1]
+            try:
+                child = frame[1].next()
+            except StopIteration:
+                stack.pop()
+                if (order == 'post' and frame[0] != None):
+                    yield frame[0]
+                continue
+            if (child.get_type() != LIST):
+                yield child
+                continue
+            if (not frame[2]):
+                frame[1] = iter(list(frame[1]))
+                frame[2] = True
+            if (order == 'pre'):
+                yield child
+            stack.append([child, self._iterlist(child, batch), False])
+
+    def open_node(self, path, type=None):
+        """Returns a DatabaseHandle on the node at path. It can be
+        given to the other methods in place of the path, and the
+        driver finds the node by its id rather than by walking down
+        the path again. The handle goes on finding the node if it
+        is moved.
+        If type is None the node can be a password or a list, with
+        passwords looked for first. Returns None for the root list.
+        Raises DatabaseNoSuchNodeException if the node doesn't exist."""
+        # the root always exists, and has no handle
+        if (not isinstance(path, DatabaseNode)
+            and self._buildnode(path) == None):
+            return None
+        stat = self.stat(path, type)
+        if (stat == None):
+            raise DatabaseNoSuchNodeException("Node does not exist", path)
+        return stat.get_node()
+
+    def stat(self, path, type=None):
+        """Returns a DatabaseStat with the type, id, number of children
+        and data size of the node at path, found in a single lookup,
+        or None if there is no such node. Its node is a handle as
+        returned by open_node().
+        If type is None the node can be a password or a list, with
+        passwords looked for first."""
+        if (type == None):
+            types = [PW, LIST]
+        else:
+            types = [type]
+        if (isinstance(path, DatabaseNode) and path.get_type() in types):
+            node = path
+        else:
+            node = self._buildnode(path, types[0])
+        try:
+            return self._stat(node, types)
+        except DatabaseNoSuchNodeException:
+            # a list above it is missing
+            return None
+
     def exists(self, path, type=PW):
         """exists(path, type=PW) -> bool
         Check if `path` exists."""
@@ -240,11 +644,10 @@ class Database:
         
     def changelist(self, path):
         """Change to list 'path'."""
-        node = self._buildnode(path, LIST)
-        if (node == None or self._exists(node)):
-            self._clist = node
-        else:
-            raise DatabaseNoSuchNodeException("List does not exist", node)
+        try:
+            self._clist = self.open_node(path, LIST)
+        except DatabaseNoSuchNodeException, e:
+            raise DatabaseNoSuchNodeException("List does not exist", e.node)
 
     def get_currentlist(self):
         """Returns current list."""
@@ -255,21 +658,51 @@ class Database:
 
     def move(self, source, dest):
         """Move object from source to dest."""
-        self.copy(source, dest)
-        if (self.exists(source, PW)):
-            self.delete(source)
-        elif (self.exists(source, LIST)):
-            self.removelist(source, True)
+        (snode, dnode) = self._copynodes(source, dest)
+        if (str(snode) == str(dnode)):
+            return
+        if (snode.get_type() == LIST
+            and str(dnode).startswith(os.path.join(str(snode), ""))):
+            raise DatabaseCopyException("Cannot move a list into itself")
+
+        # a password moved over another replaces it, as with copy.
+        # Refused before the transaction, so one around it isn't failed
+        overwrite = self._exists(dnode)
+        if (overwrite and dnode.get_type() == LIST):
+            raise DatabaseCopyException("Cannot overwrite destination")
+
+        # lists below it are now elsewhere
+        self._listindex.clear()
+        with self.transaction():
+            if (overwrite):
+                self._delete(dnode)
+            self._move(snode, dnode)
+        self._followmove(str(snode), str(dnode))
+
+    def _followmove(self, spath, dpath):
+        """The current list's handle finds it wherever it is, but its
+        path, which relative paths are built on, has to be put right
+        when it, or a list above it, is moved from spath to dpath."""
+        if (self._clist == None):
+            return
+        clist = str(self._clist)
+        if (clist == spath or clist.startswith(os.path.join(spath, ""))):
+            self._clist = self.open_node(dpath + clist[len(spath):], LIST)
 
     def copy(self, source, dest):
         """Copy object from source to dest."""
-        # check the type of source if it exists
-        if (self.exists(source, PW)):
-            snode = self._buildnode(source, PW)
-        elif (self.exists(source, LIST)):
-            snode = self._buildnode(source, LIST)
-        else:
+        (snode, dnode) = self._copynodes(source, dest)
+        self._changednode(dnode)
+        with self.transaction():
+            self._copytree(snode, dnode)
+
+    def _copynodes(self, source, dest):
+        """Returns the (source, destination) nodes for
+        copying or moving source to dest."""
+        sstat = self.stat(source)
+        if (sstat == None):
             raise DatabaseNoSuchNodeException("Source does not exist", None)
+        snode = sstat.get_node()
 
         # someone is trying to copy the root node, can't be doing that
         if (snode == None):
@@ -277,33 +710,138 @@ class Database:
             
         # if dest is a list and exists, move into it with old name
         # else move it to dest with new name
-        if (self.exists(dest, LIST)):
-            path = os.path.join(dest, snode.get_name())
-            dnode = self._buildnode(path, snode.get_type())
-        elif (self.exists(dest, PW)):
-            raise DatabaseCopyException("Cannot overwrite destination")
-        else:
+        dstat = self.stat(dest)
+        if (dstat == None):
             dnode = self._buildnode(dest, snode.get_type())
-
-        self._copy(snode, dnode)
+        elif (dstat.get_type() == LIST):
+            # the handle on dest saves looking it up again
+            dnode = DatabaseNode(snode.get_cryptedname(), dstat.get_node(),
+                                 snode.get_type(), True)
+        else:
+            raise DatabaseCopyException("Cannot overwrite destination")
+        return (snode, dnode)
 
     def _copy(self, snode, dnode):
         if (snode.get_type() == PW):
             data = self._get(snode)
             self._put(dnode, data)
-        else:
-            if (not self._exists(dnode)):
-                self._makelist(dnode)
-                nodelist = self._list(snode)
-                for i in nodelist:
-                    newdnode = DatabaseNode(i.get_name(), dnode, i.get_type())
-                    self._copy(i, newdnode)
+        elif (not self._exists(dnode)):
+            # source list -> its copy, keyed by id() of the source list
+            # which is the parent of the nodes the walk gives back
+            copies = {id(snode): (snode, dnode)}
+            self._makelist(dnode)
+            for i in self._walk(snode, 'pre', 100):
+                if (i is snode):
+                    continue
+                parent = copies[id(i.get_parent())][1]
+                # names are encrypted with the same key wherever
+                # they are, so the ciphertext can be reused as is
+                newdnode = DatabaseNode(i.get_cryptedname(), parent,
+                                        i.get_type(), True)
+                if (i.get_type() == LIST):
+                    self._makelist(newdnode)
+                    copies[id(i)] = (i, newdnode)
+                else:
+                    self._put(newdnode, self._get(i))
+
+    def compact(self):
+        """Reclaim the space left behind by removed and overwritten
+        entries, for drivers which leave any. Can take a while on a
+        large database, and can't be done inside a transaction."""
+        if (self._intransaction()):
+            raise DatabaseException("Cannot compact inside a transaction")
+        self._compact()
+
+    def flush(self):
+        """Write out what has been committed, for drivers which hold
+        the database in memory and only write it back from time to
+        time. Can't be done inside a transaction."""
+        if (self._intransaction()):
+            raise DatabaseException("Cannot flush inside a transaction")
+        self._flush()
+
+    def backup(self, dest, pages_per_step=None, progress=None):
+        """Write a consistent copy of the database to the file dest,
+        while it stays open. Drivers which can copy in steps (see
+        backup_in_steps()) copy pages_per_step pages at a time, 100 if
+        it is None. Others copy in one step and raise DatabaseException
+        if pages_per_step is given. progress(done, total) is called
+        after each step with the bytes copied so far and in all.
+        Returns the bytes copied. Can't be done inside a transaction."""
+        if (self._intransaction()):
+            raise DatabaseException("Cannot back up inside a transaction")
+        if (pages_per_step == None):
+            if (self._backupsteps()):
+                pages_per_step = 100
+        elif (not self._backupsteps()):
+            raise DatabaseException(
+                "This database backs up in one step, pages_per_step"
+                +" can't be set")
+        elif (pages_per_step < 1):
+            raise DatabaseException("Invalid pages_per_step [%s]"
+                                    % (pages_per_step))
+        return self._backup(dest, pages_per_step, progress)
+
+    def backup_in_steps(self):
+        """Returns True if backup() copies the database a number of
+        pages at a time, False if it copies it in one step."""
+        return self._backupsteps()
+
+    def transaction(self):
+        """Returns a context manager for a transaction. Operations
+        inside it are committed together when the block exits, or
+        rolled back if it raises an exception. Transactions can be
+        nested, only the outermost one commits. If a nested block
+        raises, everything is rolled back when the outermost block
+        exits, and that raises DatabaseException if the exception was
+        caught on the way out.
+
+        with db.transaction():
+            db.put("foo", foo)
+            db.put("bar", bar)
+        """
+        return DatabaseTransaction(self)
+
+    def _begintransaction(self):
+        if (self._txdepth == 0):
+            self._txfailed = False
+            self._begin()
+        self._txdepth += 1
+
+    def _endtransaction(self, success):
+        self._txdepth -= 1
+        if (not success):
+            self._txfailed = True
+        if (self._txdepth == 0):
+            if (self._txfailed):
+                # lists may have been sorted with rolled back nodes
+                self._listindex.clear()
+                self._rollback()
+                if (success):
+                    # don't let what was rolled back pass for committed
+                    raise DatabaseException("Transaction rolled back, "
+                                            "an operation in it failed")
+            else:
+                self._commit()
+
+    def _intransaction(self):
+        """Returns True if operations are part of an open transaction
+        and should not be committed by the driver."""
+        return self._txdepth > 0
 
     def changepassword(self):
         """Change the databases password."""
         newkey = self._crypto.changepassword()
+        # the first time round this makes a new key
+        self._nodecache.clear()
+        self._listindex.clear()
         return self._savekey(newkey)
 
+    def get_nodecachestats(self):
+        """Returns a dictionary with the hits, misses, hitrate, size
+        and maxsize of the path to node cache."""
+        return self._nodecache.stats()
+
     def get_cryptocallback(self):
         return self._crypto.get_callback()
 
@@ -311,6 +849,10 @@ class Database:
         self._crypto.set_callback(callback)
         
     def _buildnode(self, path, type=PW):
+        if (isinstance(path, DatabaseNode)):
+            if (path.get_type() == type):
+                return path
+            path = str(path)
         if (path == ""):
             return None
         if (not path.startswith("/")):
@@ -319,18 +861,37 @@ class Database:
                 path = os.path.join("/", path)
             else:
                 path = os.path.join(str(clist), path)
-            path = os.path.normpath(path)
+        # posix keeps a leading '//', we don't
+        path = "/" + os.path.normpath(path).lstrip("/")
         if (path == "/"):
             return None
-        (path, name) = path.rsplit("/", 1)
-        parent = self._buildnode(path, LIST)
-        try:
-            node = DatabaseNode(name, parent, type)
+
+        node = self._nodecache.get((path, type))
+        if (node != None):
             return node
+
+        # start from the closest list above path which is cached
+        end = len(path)
+        parent = None
+        while (parent == None and end > 0):
+            end = path.rfind("/", 0, end)
+            if (end > 0):
+                parent = self._nodecache.get((path[:end], LIST),
+                                             count=False)
+        try:
+            names = path[end+1:].split("/")
+            for name in names[:-1]:
+                end = end + 1 + len(name)
+                parent = DatabaseNode(name, parent, LIST)
+                self._nodecache.put((path[:end], LIST), parent)
+            node = DatabaseNode(names[-1], parent, type)
+            # names are encrypted lazily, make sure there is a key
+            node.get_cryptedname()
         except CryptoNoKeyException:
             self.changepassword()
-            print type
             return self._buildnode(path, type)
+        self._nodecache.put((path, type), node)
+        return node
 
     ##
     ## methods that need to be implemented by subclasses
@@ -365,9 +926,92 @@ class Database:
     def _exists(self, node):
         pass
 
+    def _putmany(self, parent, pairs):
+        for (node, data) in pairs:
+            self._put(node, data)
+
+    def _getmany(self, parent, nodes):
+        return [self._get(node) for node in nodes]
+
+    def _iterlist(self, node, batch):
+        return iter(self._list(node))
+
+    def _copytree(self, snode, dnode):
+        self._copy(snode, dnode)
+
+    def _move(self, snode, dnode):
+        self._copytree(snode, dnode)
+        if (snode.get_type() == PW):
+            self._delete(snode)
+        else:
+            self._removetree(snode)
+
+    def _removetree(self, node):
+        self._recursive_removelist(node)
+
+    def _stat(self, node, types):
+        # drivers without ids of their own use the path as the id
+        if (node == None):
+            if (LIST not in types):
+                return None
+            return DatabaseStat(LIST, None, len(self._list(None)), 0, None)
+        for type in types:
+            handle = DatabaseHandle(node, None, type)
+            if (not self._exists(handle)):
+                continue
+            handle._id = str(handle)
+            if (type == PW):
+                size = len(self._get(handle).get_crypteddata())
+                return DatabaseStat(PW, handle._id, 0, size, handle)
+            return DatabaseStat(LIST, handle._id, len(self._list(handle)),
+                                0, handle)
+        return None
+
+    def _count(self, node, recursive):
+        if (recursive):
+            n = 0
+            for i in self._walk(node, 'pre', 100):
+                n += 1
+            # the walk includes the list itself, unless it's the root
+            if (node != None):
+                n -= 1
+            return n
+        n = 0
+        for i in self._iterlist(node, 100):
+            n += 1
+        return n
+
+    def _du(self, node):
+        size = 0
+        for i in self._walk(node, 'pre', 100):
+            if (i.get_type() == PW):
+                size += len(self._get(i).get_crypteddata())
+        return size
+
+    def _compact(self):
+        pass
+
+    def _flush(self):
+        pass
+
+    def _backup(self, dest, pages, progress):
+        raise DatabaseException("Backup is not supported by this database")
+
+    def _backupsteps(self):
+        return False
+
     def _savekey(self, key):
         pass
         
     def _loadkey(self):
         pass
+
+    def _begin(self):
+        pass
+
+    def _commit(self):
+        pass
+
+    def _rollback(self):
+        pass
     
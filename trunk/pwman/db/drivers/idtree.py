@@ -0,0 +1,262 @@
+"""Base for PwmanDatabase implementations which keep the tree of nodes
+as records keyed by id, the root list having id 0. Paths are resolved
+one component at a time from the root, or from the nearest handle
+which still belongs to its node."""
+from pwman.db.database import Database, DatabaseNode, DatabaseData, PW, LIST
+from pwman.db.database import DatabaseHandle, DatabaseStat
+from pwman.db.database import DatabaseException, DatabaseNoSuchNodeException,\
+     DatabaseInvalidNodeException
+
+class IdTreeDatabase(Database):
+    """Database operations on a tree of nodes kept by id.
+
+    Drivers must implement:
+    IdTreeDatabase._childid(parentid, type, name)
+    IdTreeDatabase._childids(id)
+    IdTreeDatabase._noderecord(id)
+    IdTreeDatabase._addnode(parentid, type, name)
+    IdTreeDatabase._removenode(id)
+    IdTreeDatabase._movenode(id, parentid, name)
+    IdTreeDatabase._readdata(id)
+    IdTreeDatabase._writedata(id, data)
+    IdTreeDatabase._datasize(id)
+    and those of Database not implemented here: _open, _close,
+    _savekey, _loadkey, _begin, _commit and _rollback.
+
+    Drivers may also implement these, the defaults fall back
+    on the methods above:
+    IdTreeDatabase._childcount(id)
+    IdTreeDatabase._autocommit()
+    """
+
+    def _put(self, node, data):
+        if (node.get_type() != PW):
+            raise DatabaseInvalidNodeException("Not a password", node);
+        id = self._resolve(node)
+        if (id == None):
+            id = self._addnode(self._get_parentid(node), PW,
+                               node.get_cryptedname())
+        self._writedata(id, data.get_crypteddata())
+        self._autocommit()
+
+    def _putmany(self, parent, pairs):
+        parentid = self._get_nodeid(parent)
+        for (node, data) in pairs:
+            if (node.get_type() != PW):
+                raise DatabaseInvalidNodeException("Not a password", node);
+            id = self._childid(parentid, PW, node.get_cryptedname())
+            if (id == None):
+                id = self._addnode(parentid, PW, node.get_cryptedname())
+            self._writedata(id, data.get_crypteddata())
+        self._autocommit()
+
+    def _get(self, node):
+        if (node.get_type() != PW):
+            raise DatabaseInvalidNodeException("Not a password", node);
+        id = self._resolve(node)
+        if (id == None):
+            raise DatabaseNoSuchNodeException(
+                "Node does not exist in database", node)
+        return DatabaseData(self._readdata(id), True)
+
+    def _getmany(self, parent, nodes):
+        parentid = self._get_nodeid(parent)
+        datalist = []
+        for node in nodes:
+            if (node.get_type() != PW):
+                raise DatabaseInvalidNodeException("Not a password", node);
+            id = self._childid(parentid, PW, node.get_cryptedname())
+            if (id == None):
+                raise DatabaseNoSuchNodeException(
+                    "Node does not exist in database", node)
+            datalist.append(DatabaseData(self._readdata(id), True))
+        return datalist
+
+    def _delete(self, node):
+        if (node.get_type() != PW):
+            raise DatabaseInvalidNodeException("Not a password", node);
+        self._removenode(self._get_nodeid(node))
+        self._autocommit()
+
+    def _makelist(self, node):
+        if (node.get_type() != LIST):
+            raise DatabaseInvalidNodeException("Not a list", node);
+        parentid = self._get_parentid(node)
+        if (self._childid(parentid, LIST, node.get_cryptedname()) != None):
+            raise DatabaseException("List already exists")
+        self._addnode(parentid, LIST, node.get_cryptedname())
+        self._autocommit()
+
+    def _removelist(self, node):
+        if (node.get_type() != LIST):
+            raise DatabaseInvalidNodeException("Not a list", node);
+        self._removenode(self._get_nodeid(node))
+        self._autocommit()
+
+    def _removetree(self, node):
+        if (node.get_type() != LIST):
+            raise DatabaseInvalidNodeException("Not a list", node);
+        # children first, so every node removed is in a list that
+        # is still there
+        for id in reversed(self._subtree(self._get_nodeid(node))):
+            self._removenode(id)
+        self._autocommit()
+
+    def _listempty(self, node):
+        return self._childcount(self._get_nodeid(node)) == 0
+
+    def _list(self, node):
+        return list(self._iterlist(node, 100))
+
+    def _iterlist(self, node, batch):
+        # the ids are read now, so the database can be changed while
+        # the list is being walked
+        ids = list(self._childids(self._get_nodeid(node)))
+        return self._iterids(node, ids)
+
+    def _iterids(self, node, ids):
+        for id in ids:
+            record = self._noderecord(id)
+            if (record == None):
+                # removed since the list was read
+                continue
+            (parentid, type, name) = record
+            yield DatabaseHandle(DatabaseNode(name, node, type, True), id)
+
+    def _exists(self, node):
+        return self._resolve(node) != None
+
+    def _stat(self, node, types):
+        if (node == None):
+            if (LIST not in types):
+                return None
+            return DatabaseStat(LIST, 0, self._childcount(0), 0, None)
+        id = self._handleid(node)
+        if (id != None and node.get_type() in types):
+            found = [(node.get_type(), id)]
+        else:
+            parentid = self._get_parentid(node)
+            found = [(type, self._childid(parentid, type,
+                                          node.get_cryptedname()))
+                     for type in types]
+        for (type, id) in found:
+            if (id == None):
+                continue
+            handle = DatabaseHandle(node, id, type)
+            if (type == PW):
+                return DatabaseStat(PW, id, 0, self._datasize(id), handle)
+            return DatabaseStat(LIST, id, self._childcount(id), 0, handle)
+        return None
+
+    def _count(self, node, recursive):
+        id = self._get_nodeid(node)
+        if (recursive):
+            return len(self._subtree(id)) - 1
+        return self._childcount(id)
+
+    def _du(self, node):
+        size = 0
+        for id in self._subtree(self._get_nodeid(node)):
+            record = self._noderecord(id)
+            if (record != None and record[1] == PW):
+                size += self._datasize(id)
+        return size
+
+    def _copytree(self, snode, dnode):
+        sid = self._get_nodeid(snode)
+        dparentid = self._get_parentid(dnode)
+        if (snode.get_type() == PW):
+            id = self._resolve(dnode)
+            if (id == None):
+                id = self._addnode(dparentid, PW, dnode.get_cryptedname())
+            self._writedata(id, self._readdata(sid))
+            self._autocommit()
+            return
+        if (self._exists(dnode)):
+            return
+        # taken before the copy is made, which may be inside it
+        subtree = self._subtree(sid)
+        # source list id -> id of its copy
+        copies = {}
+        copies[sid] = self._addnode(dparentid, LIST, dnode.get_cryptedname())
+        for id in subtree[1:]:
+            (parentid, type, name) = self._noderecord(id)
+            newid = self._addnode(copies[parentid], type, name)
+            if (type == LIST):
+                copies[id] = newid
+            else:
+                self._writedata(newid, self._readdata(id))
+        self._autocommit()
+
+    def _move(self, snode, dnode):
+        self._movenode(self._get_nodeid(snode), self._get_parentid(dnode),
+                       dnode.get_cryptedname())
+        self._autocommit()
+
+    def _childcount(self, id):
+        """Returns the number of nodes in list id"""
+        return len(self._childids(id))
+
+    def _autocommit(self):
+        """Called at the end of each operation which changes the
+        database, for drivers which commit every operation that isn't
+        part of a transaction."""
+        pass
+
+    def _subtree(self, id):
+        """Returns the ids of node id and everything below it,
+        each list before its contents."""
+        ids = [id]
+        i = 0
+        while (i < len(ids)):
+            ids.extend(self._childids(ids[i]))
+            i += 1
+        return ids
+
+    def _handleid(self, node):
+        """Returns the id a handle carries if it still belongs to a
+        node of the right type, otherwise None."""
+        if (not isinstance(node, DatabaseHandle)):
+            return None
+        record = self._noderecord(node.get_id())
+        if (record == None or record[1] != node.get_type()):
+            return None
+        return node.get_id()
+
+    def _resolve(self, node):
+        """Returns the id of a node, or None if it doesn't exist.
+        Raises DatabaseNoSuchNodeException if one of its parents
+        doesn't exist."""
+        chain = []
+        id = 0
+        while (node != None):
+            handleid = self._handleid(node)
+            if (handleid != None):
+                id = handleid
+                break
+            chain.append(node)
+            node = node.get_parent()
+        chain.reverse()
+        for i in range(len(chain)):
+            id = self._childid(id, chain[i].get_type(),
+                               chain[i].get_cryptedname())
+            if (id == None):
+                if (i == len(chain) - 1):
+                    return None
+                raise DatabaseNoSuchNodeException(
+                    "Path does not exist", chain[-1])
+        return id
+
+    def _get_nodeid(self, node):
+        """Returns the id of a node"""
+        id = self._resolve(node)
+        if (id == None):
+            raise DatabaseNoSuchNodeException("Node does not exist", node)
+        return id
+
+    def _get_parentid(self, node):
+        """Returns the id of the list node is in"""
+        parentid = self._resolve(node.get_parent())
+        if (parentid == None):
+            raise DatabaseNoSuchNodeException("Path does not exist", node)
+        return parentid
@@ -0,0 +1,430 @@
+"""Append only PwmanDatabase implementation. Every change is appended
+to a single log file, nothing already written is ever changed, so an
+interrupted write can only lose the operation being written.
+
+The log starts with a header, the magic string and a random token
+naming this log. Then come records, each a 4 byte length, the CRC32
+of the payload and the payload, a one letter op and its fields
+(ids are packed as unsigned 32 bit big endian integers):
+N<id><parent id><type code><crypted name>  node added, or moved
+X<id>                                      node removed
+D<id><crypted data>                        password data
+K<crypted key>                             key changed
+C<next id>                                 commit
+Each operation, or transaction, is followed by a commit record.
+Records after the last commit record were never committed and are
+dropped when the log is opened.
+
+The nodes and the offsets of the data are kept in memory, so reads
+cost one seek. They are rebuilt on open by scanning the log, starting
+from the checkpoint written on close if it is for this log. compact()
+rewrites the log with only what is live."""
+from pwman.db.drivers.memory import MemoryDatabase, _missing
+from pwman.db.database import PW, LIST, DatabaseException
+
+import cPickle
+import mmap
+import os
+import struct
+import zlib
+
+_magic = "PWMANLOG1\n"
+_tokensize = 16
+_typecodes = {PW: 0, LIST: 1}
+_types = {0: PW, 1: LIST}
+
+def _record(payload):
+    return struct.pack("!II", len(payload),
+                       zlib.crc32(payload) & 0xffffffff) + payload
+
+class LogDatabase(MemoryDatabase):
+    """Log Database implementation.
+    The nodes and data are kept as by MemoryDatabase, except that
+    committed data is held as (offset, length) in the log. Changes
+    are appended to a buffer as they are made, which is written out
+    and synced with a commit record when they are committed."""
+
+    def __init__(self, params):
+        """Initialise LogDatabase instance. The only Log specific
+        param is 'filename', the log file. The checkpoint is kept
+        next to it, with .checkpoint added to the name."""
+        MemoryDatabase.__init__(self, params)
+
+        try:
+            self._filename = params['Database']['filename']
+        except KeyError, e:
+            raise DatabaseException("Log: missing parameter [%s]" % (e))
+        self._checkpointname = self._filename + ".checkpoint"
+
+    def _open(self):
+        self._nodes = {}
+        self._children = {0: {}}
+        self._data = {}
+        self._key = None
+        self._nextid = 1
+        self._undo = None
+        # records not yet committed, and id -> offset in the buffer
+        # of the latest data in them
+        self._buffer = []
+        self._buffersize = 0
+        self._bufferdata = {}
+        # set when a failed commit couldn't be cut off the log
+        self._damaged = False
+        try:
+            if (not os.path.exists(self._filename)):
+                self._create(self._filename)
+            # unbuffered, so a failed write leaves nothing behind in a
+            # buffer to be written out later
+            self._file = open(self._filename, "r+b", 0)
+            header = self._file.read(len(_magic) + _tokensize)
+            if (not header.startswith(_magic)):
+                self._file.close()
+                raise DatabaseException("Log: %s is not a pwman log"
+                                        % (self._filename))
+            self._token = header[len(_magic):]
+            self._replay(self._loadcheckpoint())
+        except (IOError, OSError), e:
+            raise DatabaseException("Log: %s" % (e))
+
+    def _close(self):
+        try:
+            # uncommitted data isn't in the log yet
+            if (not self._intransaction()):
+                self.checkpoint()
+        finally:
+            self._file.close()
+
+    def _put(self, node, data):
+        self._committed(MemoryDatabase._put, node, data)
+
+    def _putmany(self, parent, pairs):
+        self._committed(MemoryDatabase._putmany, parent, pairs)
+
+    def _delete(self, node):
+        self._committed(MemoryDatabase._delete, node)
+
+    def _makelist(self, node):
+        self._committed(MemoryDatabase._makelist, node)
+
+    def _removelist(self, node):
+        self._committed(MemoryDatabase._removelist, node)
+
+    def _removetree(self, node):
+        self._committed(MemoryDatabase._removetree, node)
+
+    def _copytree(self, snode, dnode):
+        self._committed(MemoryDatabase._copytree, snode, dnode)
+
+    def _move(self, snode, dnode):
+        self._committed(MemoryDatabase._move, snode, dnode)
+
+    def _savekey(self, key):
+        self._committed(LogDatabase._setkey, key)
+
+    def _setkey(self, key):
+        self._key = key
+        self._append("K" + key)
+
+    def _committed(self, method, *args):
+        """Call method, then commit what it did unless a transaction
+        is open. If it fails what it did is undone."""
+        if (self._intransaction()):
+            method(self, *args)
+            return
+        self._begin()
+        try:
+            method(self, *args)
+        except:
+            self._rollback()
+            raise
+        self._commit()
+
+    def _commit(self):
+        """Append the buffered records and a commit record to the log,
+        and sync it"""
+        self._append("C" + struct.pack("!I", self._nextid))
+        if (self._damaged):
+            self._rollback()
+            raise DatabaseException("Log: %s could not be repaired after an"
+                                    " error, reopen it" % (self._filename))
+        start = None
+        try:
+            self._file.seek(0, 2)
+            start = self._file.tell()
+            self._file.write("".join(self._buffer))
+            os.fsync(self._file.fileno())
+        except (IOError, OSError), e:
+            self._rollback()
+            self._cutoff(start)
+            raise DatabaseException("Log: Error committing [%s]" % (e))
+        # data written out is read back from the log from now on
+        for (id, offset) in self._bufferdata.items():
+            data = self._data.get(id)
+            if (isinstance(data, str)):
+                self._data[id] = (start + offset, len(data))
+        self._clearbuffer()
+        MemoryDatabase._commit(self)
+
+    def _rollback(self):
+        self._clearbuffer()
+        MemoryDatabase._rollback(self)
+
+    def _cutoff(self, start):
+        """Cut off what a failed commit wrote from offset start on.
+        Left there it could be read back as part of the next commit,
+        or, cut short, hide the commits after it when the log is
+        replayed. If it can't be cut off no more commits are made."""
+        if (start == None):
+            return
+        try:
+            self._file.truncate(start)
+            os.fsync(self._file.fileno())
+        except (IOError, OSError):
+            self._damaged = True
+
+    def _compact(self):
+        """Write a new log with only what is live, and replace the
+        old one with it"""
+        newname = self._filename + ".compact"
+        offsets = {}
+        try:
+            self._create(newname)
+            new = open(newname, "r+b")
+            try:
+                new.seek(0, 2)
+                token = self._readtoken(new)
+                # parents before their contents, a node's id can be
+                # lower than its parent's if it has been moved
+                for id in self._subtree(0)[1:]:
+                    (parentid, type, name) = self._nodes[id]
+                    new.write(_record("N" + struct.pack("!IIB", id, parentid,
+                                                        _typecodes[type])
+                                      + name))
+                    if (type == PW):
+                        data = self._readdata(id)
+                        payload = "D" + struct.pack("!I", id) + data
+                        offsets[id] = (new.tell() + 8 + 5, len(data))
+                        new.write(_record(payload))
+                if (self._key != None):
+                    new.write(_record("K" + self._key))
+                new.write(_record("C" + struct.pack("!I", self._nextid)))
+                new.flush()
+                os.fsync(new.fileno())
+            finally:
+                new.close()
+            self._file.close()
+            os.rename(newname, self._filename)
+            self._file = open(self._filename, "r+b", 0)
+        except (IOError, OSError), e:
+            raise DatabaseException("Log: Error compacting [%s]" % (e))
+        self._token = token
+        self._data = offsets
+        self.checkpoint()
+
+    def _backup(self, dest, pages, progress):
+        """Copy the log as it is now, pages of 4096 bytes at a time.
+        Nothing before the end of the log changes, so the copy is
+        consistent. It gets a token of its own, so checkpoints of this
+        log are never used with it."""
+        newname = dest + ".new"
+        step = pages * 4096
+        try:
+            try:
+                self._file.seek(0, 2)
+                total = self._file.tell()
+                self._create(newname)
+                new = open(newname, "r+b")
+                try:
+                    # the header with the new token is already there
+                    new.seek(0, 2)
+                    done = new.tell()
+                    while (done < total):
+                        self._file.seek(done)
+                        new.write(self._file.read(min(step, total - done)))
+                        done = new.tell()
+                        if (progress != None):
+                            progress(done, total)
+                    new.flush()
+                    os.fsync(new.fileno())
+                finally:
+                    new.close()
+                os.rename(newname, dest)
+            finally:
+                if (os.path.exists(newname)):
+                    os.remove(newname)
+        except (IOError, OSError), e:
+            raise DatabaseException("Log: Error backing up to %s [%s]"
+                                    % (dest, e))
+        return total
+
+    def _backupsteps(self):
+        return True
+
+    def checkpoint(self):
+        """Save the in memory index of the log, so the next open only
+        has to scan what has been added to the log since. Can't be
+        done inside a transaction."""
+        if (self._intransaction()):
+            raise DatabaseException("Cannot checkpoint inside a transaction")
+        self._file.seek(0, 2)
+        state = (self._token, self._file.tell(), self._nodes, self._data,
+                 self._key, self._nextid)
+        newname = self._checkpointname + ".new"
+        try:
+            f = open(newname, "wb")
+            try:
+                cPickle.dump(state, f, 2)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            os.rename(newname, self._checkpointname)
+        except (IOError, OSError), e:
+            raise DatabaseException("Log: Error writing checkpoint [%s]"
+                                    % (e))
+
+    def _loadcheckpoint(self):
+        """Load the checkpoint if it is for this log, and return the
+        offset to replay the log from."""
+        start = len(_magic) + _tokensize
+        try:
+            f = open(self._checkpointname, "rb")
+            try:
+                state = cPickle.load(f)
+            finally:
+                f.close()
+            (token, offset, nodes, data, key, nextid) = state
+        except (IOError, EOFError, ValueError, TypeError,
+                cPickle.UnpicklingError):
+            # missing or damaged, the whole log is scanned instead
+            return start
+        self._file.seek(0, 2)
+        if (token != self._token or offset > self._file.tell()):
+            return start
+        self._nodes = nodes
+        self._data = data
+        self._key = key
+        self._nextid = nextid
+        for (id, (parentid, type, name)) in nodes.items():
+            self._children.setdefault(parentid, {})[(type, name)] = id
+            if (type == LIST):
+                self._children.setdefault(id, {})
+        return offset
+
+    def _replay(self, start):
+        """Apply the committed records from offset start on, and cut
+        off anything after the last commit record."""
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        committed = start
+        if (size > start):
+            log = mmap.mmap(self._file.fileno(), size,
+                            access=mmap.ACCESS_READ)
+            try:
+                # records since the last commit record
+                staged = []
+                pos = start
+                while (pos + 8 <= size):
+                    (length, crc) = struct.unpack("!II", log[pos:pos+8])
+                    end = pos + 8 + length
+                    if (length == 0 or end > size):
+                        break
+                    payload = log[pos+8:end]
+                    if (zlib.crc32(payload) & 0xffffffff != crc):
+                        break
+                    staged.append((payload, pos + 8))
+                    if (payload[0] == "C"):
+                        for (payload, offset) in staged:
+                            self._apply(payload, offset)
+                        staged = []
+                        committed = end
+                    pos = end
+            finally:
+                log.close()
+        if (committed < size):
+            self._file.truncate(committed)
+
+    def _apply(self, payload, offset):
+        """Apply a record read from the log at offset"""
+        op = payload[0]
+        if (op == "N"):
+            (id, parentid, type) = struct.unpack("!IIB", payload[1:10])
+            type = _types[type]
+            name = payload[10:]
+            if (self._nodes.has_key(id)):
+                # moved
+                (oldparent, oldtype, oldname) = self._nodes[id]
+                del self._children[oldparent][(oldtype, oldname)]
+            self._nodes[id] = [parentid, type, name]
+            self._children.setdefault(parentid, {})[(type, name)] = id
+            if (type == LIST):
+                self._children.setdefault(id, {})
+        elif (op == "X"):
+            (id,) = struct.unpack("!I", payload[1:5])
+            (parentid, type, name) = self._nodes.pop(id)
+            del self._children[parentid][(type, name)]
+            self._children.pop(id, None)
+            self._data.pop(id, None)
+        elif (op == "D"):
+            (id,) = struct.unpack("!I", payload[1:5])
+            self._data[id] = (offset + 5, len(payload) - 5)
+        elif (op == "K"):
+            self._key = payload[1:]
+        elif (op == "C"):
+            (nextid,) = struct.unpack("!I", payload[1:5])
+            self._nextid = max(self._nextid, nextid)
+
+    def _set(self, table, key, value):
+        MemoryDatabase._set(self, table, key, value)
+        # the nodes and data are logged, the lists follow from them
+        if (table is self._nodes):
+            if (value is _missing):
+                self._append("X" + struct.pack("!I", key))
+            else:
+                (parentid, type, name) = value
+                self._append("N" + struct.pack("!IIB", key, parentid,
+                                               _typecodes[type]) + name)
+        elif (table is self._data and value is not _missing):
+            self._bufferdata[key] = self._buffersize + 8 + 5
+            self._append("D" + struct.pack("!I", key) + value)
+
+    def _append(self, payload):
+        record = _record(payload)
+        self._buffer.append(record)
+        self._buffersize += len(record)
+
+    def _clearbuffer(self):
+        self._buffer = []
+        self._buffersize = 0
+        self._bufferdata = {}
+
+    def _readdata(self, id):
+        data = self._data[id]
+        if (isinstance(data, str)):
+            # not committed yet
+            return data
+        (offset, length) = data
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def _datasize(self, id):
+        data = self._data[id]
+        if (isinstance(data, str)):
+            return len(data)
+        return data[1]
+
+    def _create(self, filename):
+        """Create an empty log, with a new token"""
+        f = open(filename, "wb")
+        try:
+            f.write(_magic + os.urandom(_tokensize))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def _readtoken(self, f):
+        f.seek(len(_magic))
+        token = f.read(_tokensize)
+        f.seek(0, 2)
+        return token
@@ -0,0 +1,134 @@
+"""In memory PwmanDatabase implementation. Nothing is written to disk,
+the database only lasts as long as the MemoryDatabase instance, which
+makes it a baseline for benchmarks and a fast driver for tests."""
+from pwman.db.database import DatabaseNode, LIST
+from pwman.db.database import DatabaseHandle
+from pwman.db.drivers.idtree import IdTreeDatabase
+
+# marks a key which wasn't there before a change, in the undo log
+_missing = object()
+
+class MemoryDatabase(IdTreeDatabase):
+    """Memory Database implementation.
+    Nodes are stored in dictionaries keyed by id, the root list has id 0:
+    _nodes maps an id to [parent id, type, crypted name]
+    _children maps the id of a list to a dictionary of
+    (type, crypted name) to id, for the nodes in it
+    _data maps the id of a password to its crypted data"""
+
+    def __init__(self, params):
+        """Initialise MemoryDatabase instance. There are no
+        Memory specific params."""
+        IdTreeDatabase.__init__(self, params)
+
+        self._nodes = {}
+        self._children = {0: {}}
+        self._data = {}
+        self._key = None
+        # ids are never reused, like AUTOINCREMENT in SQLite
+        self._nextid = 1
+        # (dictionary, key, old value) for each change made in the
+        # open transaction, or None outside a transaction
+        self._undo = None
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def _iterlist(self, node, batch):
+        # the contents as they are now, so the database can be
+        # changed while the list is being walked
+        items = self._children[self._get_nodeid(node)].items()
+        return self._iteritems(node, items)
+
+    def _iteritems(self, node, items):
+        for ((type, name), id) in items:
+            yield DatabaseHandle(DatabaseNode(name, node, type, True), id)
+
+    def _savekey(self, key):
+        self._key = key
+
+    def _loadkey(self):
+        return self._key
+
+    def _begin(self):
+        self._undo = []
+
+    def _commit(self):
+        self._undo = None
+
+    def _rollback(self):
+        """Undo the changes made since the transaction began."""
+        undo = self._undo
+        self._undo = None
+        if (undo == None):
+            return
+        undo.reverse()
+        for (table, key, old) in undo:
+            if (old is _missing):
+                del table[key]
+            else:
+                table[key] = old
+
+    def _set(self, table, key, value):
+        """Set table[key] to value, or delete it if value is _missing,
+        logging the old value if a transaction is open."""
+        if (self._undo != None):
+            self._undo.append((table, key, table.get(key, _missing)))
+        if (value is _missing):
+            del table[key]
+        else:
+            table[key] = value
+
+    def _readdata(self, id):
+        return self._data[id]
+
+    def _writedata(self, id, data):
+        self._set(self._data, id, data)
+
+    def _datasize(self, id):
+        return len(self._data[id])
+
+    def _childid(self, parentid, type, name):
+        children = self._children.get(parentid)
+        if (children == None):
+            return None
+        return children.get((type, name))
+
+    def _childids(self, id):
+        children = self._children.get(id)
+        if (children == None):
+            return ()
+        return children.values()
+
+    def _childcount(self, id):
+        return len(self._children[id])
+
+    def _noderecord(self, id):
+        return self._nodes.get(id)
+
+    def _addnode(self, parentid, type, name):
+        id = self._nextid
+        self._nextid += 1
+        self._set(self._nodes, id, [parentid, type, name])
+        self._set(self._children[parentid], (type, name), id)
+        if (type == LIST):
+            self._set(self._children, id, {})
+        return id
+
+    def _removenode(self, id):
+        (parentid, type, name) = self._nodes[id]
+        self._set(self._children[parentid], (type, name), _missing)
+        self._set(self._nodes, id, _missing)
+        if (type == LIST):
+            self._set(self._children, id, _missing)
+        else:
+            self._set(self._data, id, _missing)
+
+    def _movenode(self, id, parentid, name):
+        (oldparentid, type, oldname) = self._nodes[id]
+        self._set(self._children[oldparentid], (type, oldname), _missing)
+        self._set(self._children[parentid], (type, name), id)
+        self._set(self._nodes, id, [parentid, type, name])
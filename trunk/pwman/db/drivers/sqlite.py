@@ -1,97 +1,239 @@
 """SQLite PwmanDatabase implementation."""
 from pwman.db.database import Database, DatabaseNode, DatabaseData, PW, LIST
+from pwman.db.database import DatabaseHandle, DatabaseStat
 from pwman.db.database import DatabaseException, DatabaseNoSuchNodeException,\
      DatabaseInvalidNodeException
 
+from pwman.util.cache import LRUCache
 from pysqlite2 import dbapi2 as sqlite
+import os
+import time
+import weakref
+
+# Schema migrations, in order. Migration n brings a vault from schema
+# version n-1 to version n. A vault without a version table is at
+# version 0, the layout created by SQLiteDatabase._checktables.
+# Each one is an SQL script run in a single transaction, table names
+# are filled in from the nodes, data and keys keys.
+_migrations = [
+    # 1: index node lookups, and tie the data to its node
+    """CREATE INDEX %(nodes)s_LOOKUP ON %(nodes)s(PARENT, DATATYPE, NODENAME);
+    CREATE TABLE %(data)s_NEW(ID INTEGER NOT NULL PRIMARY KEY
+        REFERENCES %(nodes)s(ID) ON DELETE CASCADE,
+        DATA BLOB NOT NULL);
+    INSERT INTO %(data)s_NEW SELECT ID, DATA FROM %(data)s
+        WHERE ID IN (SELECT ID FROM %(nodes)s);
+    DROP TABLE %(data)s;
+    ALTER TABLE %(data)s_NEW RENAME TO %(data)s;""",
+    # 2: make names unique within a list, so writes can use upserts.
+    # Lookups always found the lowest id, so later duplicates (which
+    # nothing could reach) are dropped
+    """DELETE FROM %(data)s WHERE ID IN (SELECT ID FROM %(nodes)s
+        WHERE ID NOT IN (SELECT MIN(ID) FROM %(nodes)s
+                         GROUP BY PARENT, DATATYPE, NODENAME));
+    DELETE FROM %(nodes)s WHERE ID NOT IN (SELECT MIN(ID) FROM %(nodes)s
+        GROUP BY PARENT, DATATYPE, NODENAME);
+    DROP INDEX %(nodes)s_LOOKUP;
+    CREATE UNIQUE INDEX %(nodes)s_LOOKUP
+        ON %(nodes)s(PARENT, DATATYPE, NODENAME);""",
+    ]
+
+# Tuning profiles, the 'profile' param, as the PRAGMAs run on open.
+# durable:     rollback journal, synced on every commit. SQLite's defaults
+# balanced:    write ahead log, only synced at checkpoints. A crash can
+#              lose the last commits, but not corrupt the vault
+# bulk-import: for loading a lot at once. Never synced, big cache, and
+#              the file is locked until closed. A crash can corrupt it
+_profiles = {
+    'durable': ["PRAGMA journal_mode = DELETE",
+                "PRAGMA synchronous = FULL"],
+    'balanced': ["PRAGMA journal_mode = WAL",
+                 "PRAGMA synchronous = NORMAL"],
+    'bulk-import': ["PRAGMA journal_mode = MEMORY",
+                    "PRAGMA synchronous = OFF",
+                    "PRAGMA cache_size = -65536",
+                    "PRAGMA temp_store = MEMORY",
+                    "PRAGMA locking_mode = EXCLUSIVE"],
+    }
+# profiles autotune can recommend for everyday use
+_safeprofiles = ['durable', 'balanced']
 
 class SQLiteDatabase(Database):
     """SQLite Database implementation"""
     
     def __init__(self, params):
         """Initialise SQLitePwmanDatabase instance.
-        Currently, the only SQLite specific param is 'filename'.
-        This points to the database file which we should use."""
+        The SQLite specific params are:
+        filename:      The database file which we should use.
+        inmemory:      If yes, the database is copied into memory when
+                       it is opened and served from there. It is
+                       written back to the file on close, on flush(),
+                       and on the first commit flushinterval seconds
+                       after it was last written. Defaults to no.
+        flushinterval: Defaults to 60, 0 only writes back on close
+                       and flush().
+        profile:       The tuning profile, one of durable, balanced
+                       or bulk-import. Without one nothing is changed.
+                       The journal mode is kept in the file, so a
+                       vault opened with balanced stays in WAL mode
+                       until it is opened with durable.
+        idcache:       The number of node ids kept to save looking
+                       them up again. Defaults to 10000."""
         Database.__init__(self, params)
 
         self._nodetable = 'NODES';
         self._datatable = 'DATA';
         self._keytable = 'KEYS';
+        self._versiontable = 'SCHEMAVERSION';
+        self._copytable = 'COPYMAP';
+        # path components resolved per query, keeps the number of
+        # bound parameters under SQLITE_MAX_VARIABLE_NUMBER
+        self._chainchunk = 200
+        # shorter chains are cheaper to walk one level per query
+        self._shortchain = 8
         try:
             self._filename = params['Database']['filename']
         except KeyError, e:
             raise DatabaseException(
                 "SQLite: missing parameter [%s]" % (e))
+        options = params['Database']
+        self._inmemory = str(options.get('inmemory', 'no')).lower() \
+                         in ('1', 'yes', 'true', 'on')
+        try:
+            self._flushinterval = float(options.get('flushinterval', 60))
+        except ValueError, e:
+            raise DatabaseException("SQLite: invalid flushinterval [%s]" % (e))
+        try:
+            idcache = int(options.get('idcache', 10000))
+        except ValueError, e:
+            raise DatabaseException("SQLite: invalid idcache [%s]" % (e))
+        # maps (parent id, type, crypted name) to the node id.
+        # ids are never reused (AUTOINCREMENT), so only entries
+        # for rows which go away need to be dropped.
+        self._idcache = LRUCache(idcache)
+        self._profile = options.get('profile')
+        if (self._profile != None and not _profiles.has_key(self._profile)):
+            raise DatabaseException("SQLite: unknown profile [%s]"
+                                    % (self._profile))
 
     def _open(self):
+        self._con = None
+        try:
+            self._connect()
+        except DatabaseException:
+            # a connection left open could hold the vault locked
+            if (self._con != None):
+                self._con.close()
+                self._con = None
+            raise
+
+    def _connect(self):
         try:
-            self._con = sqlite.connect(self._filename)
+            if (self._inmemory):
+                self._con = self._load()
+                # changes made since, from total_changes
+                self._flushedchanges = self._con.total_changes
+                self._lastflush = time.time()
+            else:
+                self._con = sqlite.connect(self._filename)
             self._cur = self._con.cursor()
+            self._idcache.clear()
+            self._forget()
+            self._cur.execute("PRAGMA foreign_keys = ON")
+            if (self._profile != None):
+                self._tune(self._cur, self._profile)
             self._checktables()
+            # old to new ids of the nodes being copied by _copytree.
+            # Created here as DDL would commit an open transaction
+            self._cur.execute("CREATE TEMP TABLE " + self._copytable
+                              + "(NEWID INTEGER PRIMARY KEY,"
+                              + " OLDID INTEGER UNIQUE)")
         except sqlite.DatabaseError, e:
-            raise DatabaseException("SQLite: %s" % (s))
-        
+            raise DatabaseException("SQLite: %s" % (e))
 
     def _put(self, node, data):
         if (node.get_type() != PW):
             raise DatabaseInvalidNodeException("Not a password", node);
 
-        if self._exists(node):
-            id = self._get_nodeid(node)
-        else:
-            id = 0
+        # nodes seen before, and handles, are found by id
+        id = self._remembered(node)
+        if (id == None):
+            parentid = self._cachedid(node.get_parent())
+            if (parentid == None):
+                # the node itself comes for free with its parents
+                id = self._resolve(node)
+                parentid = self._get_parentid(node)
+            else:
+                id = self._idcache.get((parentid, PW,
+                                        node.get_cryptedname()))
+                if (id != None):
+                    self._remember(node, id)
 
-        # create statements for adding the nodes to the database
-        if id == 0:
-            sql = "INSERT INTO "+self._nodetable \
-                  +"(DATATYPE, NODENAME, PARENT)  VALUES(?, ?, ?)"
-            values = (node.get_type(), node.get_cryptedname(),
-                      self._get_parentid(node))
-            try:
-                self._cur.execute(sql, values)
-            except sqlite.DatabaseError, e:
-                raise DatabaseException(
-                    "SQLite: Error creating node in db [%s]" % (e))
+        try:
+            if (id == None):
+                # creates the node, or finds it if it is already there
+                sql = "INSERT INTO "+self._nodetable \
+                      +"(DATATYPE, NODENAME, PARENT) VALUES(?, ?, ?) " \
+                      +"ON CONFLICT(PARENT, DATATYPE, NODENAME) " \
+                      +"DO UPDATE SET PARENT = excluded.PARENT RETURNING ID"
+                self._cur.execute(sql, (PW, node.get_cryptedname(), parentid))
+                id = self._cur.fetchone()[0]
+                self._idcache.put((parentid, PW, node.get_cryptedname()), id)
+                self._remember(node, id)
 
-            sql = "INSERT INTO "+self._datatable+" VALUES(?, ?)"
-            values = (self._cur.lastrowid, data.get_crypteddata());
+            sql = "INSERT INTO "+self._datatable+"(ID, DATA) VALUES(?, ?) " \
+                  +"ON CONFLICT(ID) DO UPDATE SET DATA = excluded.DATA"
+            self._cur.execute(sql, (id, data.get_crypteddata()))
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error putting data in db [%s]" % (e))
+        self._autocommit("Error commiting data to db")
 
-            # insert the data into the database
-            try:
-                self._cur.execute(sql, values)
-            except sqlite.DatabaseError, e:
-                raise DatabaseException(
-                    "SQLite: Error creating data in db [%s]" % (e))
-        else:
-            sql = "UPDATE "+self._datatable+" SET DATA=? WHERE ID=?"
-            values = (data.get_crypteddata(), id)
+    def _putmany(self, parent, pairs):
+        parentid = self._get_nodeid(parent)
+        # the last of several puts to the same name wins
+        bynames = {}
+        for (node, data) in pairs:
+            if (node.get_type() != PW):
+                raise DatabaseInvalidNodeException("Not a password", node);
+            bynames[node.get_cryptedname()] = data.get_crypteddata()
 
-            # update database with new data
-            try:
-                self._cur.execute(sql, values)
-            except sqlite.DatabaseError, e:
-                raise DatabaseException(
-                    "SQLite: Error updating data in db [%s]" % (e))
+        ids = self._childids(parentid, PW, bynames.keys())
+        newnames = [name for name in bynames.keys()
+                    if not ids.has_key(name)]
         try:
-            self._con.commit()
-        except DatabaseError, e:
-            self._con.rollback()
+            self._cur.executemany("UPDATE "+self._datatable
+                                  +" SET DATA=? WHERE ID=?",
+                                  [(bynames[name], id)
+                                   for (name, id) in ids.items()])
+            self._cur.executemany("INSERT INTO "+self._nodetable
+                                  +"(DATATYPE, NODENAME, PARENT)"
+                                  +" VALUES(?, ?, ?)",
+                                  [(PW, name, parentid)
+                                   for name in newnames])
+            ids = self._childids(parentid, PW, newnames)
+            self._cur.executemany("INSERT INTO "+self._datatable
+                                  +" VALUES(?, ?)",
+                                  [(id, bynames[name])
+                                   for (name, id) in ids.items()])
+        except sqlite.DatabaseError, e:
             raise DatabaseException(
-                "SQLite: Error commiting data to db [%s]" % (e))
+                "SQLite: Error putting data in db [%s]" % (e))
+        self._autocommit("Error commiting data to db")
 
     def _get(self, node):
         if (node.get_type() != PW):
             raise DatabaseInvalidNodeException(
                 "Not a password", node);
 
-        sql = "SELECT DATA FROM "+self._nodetable \
-              +" INNER JOIN "+self._datatable+" ON " \
-              +self._nodetable+".ID = "+self._datatable+".ID " \
-              +"WHERE DATATYPE = ? AND NODENAME = ? AND PARENT = ?"
-        values = (node.get_type(), node.get_cryptedname(), \
-                  self._get_parentid(node))
+        id = self._resolve(node)
+        if (id == None):
+            raise DatabaseNoSuchNodeException(
+                "Node does not exist in database", node)
+
+        sql = "SELECT DATA FROM "+self._datatable+" WHERE ID = ?"
         try:
-            self._cur.execute(sql, values)
+            self._cur.execute(sql, [id])
             data = self._cur.fetchone()
             if (data == None):
                 raise DatabaseNoSuchNodeException(
@@ -103,12 +245,40 @@ class SQLiteDatabase(Database):
             raise DatabaseException(
                 "SQLite: Error reading node from db [%s]" % (e))
 
+    def _getmany(self, parent, nodes):
+        parentid = self._get_nodeid(parent)
+        for node in nodes:
+            if (node.get_type() != PW):
+                raise DatabaseInvalidNodeException("Not a password", node);
+        names = [node.get_cryptedname() for node in nodes]
+
+        sql = "SELECT NODENAME, DATA FROM "+self._nodetable \
+              +" INNER JOIN "+self._datatable+" ON " \
+              +self._nodetable+".ID = "+self._datatable+".ID " \
+              +"WHERE PARENT = ? AND DATATYPE = ? AND NODENAME IN (" \
+              +", ".join(["?"] * len(names))+")"
+        try:
+            self._cur.execute(sql, [parentid, PW] + names)
+            datas = dict(self._cur.fetchall())
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error reading nodes from db [%s]" % (e))
+
+        datalist = []
+        for node in nodes:
+            if (not datas.has_key(node.get_cryptedname())):
+                raise DatabaseNoSuchNodeException(
+                    "Node does not exist in database", node)
+            datalist.append(DatabaseData(datas[node.get_cryptedname()], True))
+        return datalist
+
     def _delete(self, node):
         if (node.get_type() != PW):
-            raise DatabaseInvalidNodeException("Not a password");
+            raise DatabaseInvalidNodeException("Not a password", node);
         
         # get the id
         id = self._get_nodeid(node)
+        key = self._nodekey(node)
 
         # delete the node from the db
         try:
@@ -119,18 +289,81 @@ class SQLiteDatabase(Database):
         except sqlite.DatabaseError, e:
             raise DatabaseException(
                 "SQLite: Error deleting from db [%s]" % (e))
+        self._idcache.remove(key)
+        self._forget(id)
 
         # commit the delete to the database
+        self._autocommit("Error committing delete to db")
+        
+    def _copytree(self, snode, dnode):
+        if (snode.get_type() != LIST):
+            Database._copytree(self, snode, dnode)
+            return
+        if (self._exists(dnode)):
+            return
+
+        sid = self._get_nodeid(snode)
+        dparentid = self._get_parentid(dnode)
         try:
-            self._con.commit()
+            # number the copies after the highest id ever handed out,
+            # so no id is reused
+            self._cur.execute("DELETE FROM "+self._copytable)
+            self._cur.execute("INSERT INTO "+self._copytable+"(NEWID) "
+                              +"SELECT MAX(ID) FROM (SELECT MAX(ID) AS ID "
+                              +"FROM "+self._nodetable+" UNION ALL "
+                              +"SELECT SEQ FROM SQLITE_SEQUENCE "
+                              +"WHERE NAME = ?)", [self._nodetable])
+            self._cur.execute("INSERT INTO "+self._copytable+"(OLDID) "
+                              +self._subtreesql()+" ORDER BY ID", [sid])
+            self._cur.execute("INSERT INTO "+self._nodetable
+                              +"(ID, NODENAME, DATATYPE, PARENT) "
+                              +"SELECT M.NEWID, CASE WHEN N.ID = ? "
+                              +"THEN ? ELSE N.NODENAME END, N.DATATYPE, "
+                              +"COALESCE(P.NEWID, ?) "
+                              +"FROM "+self._copytable+" AS M "
+                              +"JOIN "+self._nodetable+" AS N "
+                              +"ON N.ID = M.OLDID "
+                              +"LEFT JOIN "+self._copytable+" AS P "
+                              +"ON P.OLDID = N.PARENT",
+                              (sid, dnode.get_cryptedname(), dparentid))
+            self._cur.execute("INSERT INTO "+self._datatable+"(ID, DATA) "
+                              +"SELECT M.NEWID, D.DATA "
+                              +"FROM "+self._copytable+" AS M "
+                              +"JOIN "+self._datatable+" AS D "
+                              +"ON D.ID = M.OLDID")
+            self._cur.execute("DELETE FROM "+self._copytable)
         except sqlite.DatabaseError, e:
-            self._con.rollback()
             raise DatabaseException(
-                "SQLite: Error committing delete to db [%s]" % (e))
-        
+                "SQLite: Error copying list [%s]" % (e))
+        self._autocommit("Error committing copy")
+
+    def _move(self, snode, dnode):
+        id = self._get_nodeid(snode)
+        key = self._nodekey(snode)
+        dparentid = self._get_parentid(dnode)
+        try:
+            self._cur.execute("UPDATE "+self._nodetable
+                              +" SET PARENT = ?, NODENAME = ? WHERE ID = ?",
+                              (dparentid, dnode.get_cryptedname(), id))
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error moving node [%s]" % (e))
+        # the node keeps its id, so only its own entry changes
+        self._idcache.remove(key)
+        self._idcache.put((dparentid, dnode.get_type(),
+                           dnode.get_cryptedname()), id)
+        self._forget()
+        self._autocommit("Error committing move")
+
     def _close(self):
+        if (self._inmemory):
+            # uncommitted changes are dropped, as they are on disk
+            self._con.rollback()
+            self._flush()
         self._cur.close()
         self._con.close()
+        self._idcache.clear()
+        self._forget()
 
     def _makelist(self, node):
         if (node.get_type() != LIST):
@@ -138,14 +371,16 @@ class SQLiteDatabase(Database):
                 "Not a list", node);
         sql = "INSERT INTO "+self._nodetable \
               +"(DATATYPE, NODENAME, PARENT)  VALUES(?, ?, ?)"
-        values = (node.get_type(), node.get_cryptedname(),
-                  self._get_parentid(node))
+        key = self._nodekey(node)
+        values = (node.get_type(), node.get_cryptedname(), key[0])
         try:
             self._cur.execute(sql, values)
-            self._con.commit()
         except sqlite.DatabaseError, e:
             raise DatabaseException(
                 "SQLite: Error creating list [%s]" % (e))
+        self._idcache.put(key, self._cur.lastrowid)
+        self._remember(node, self._cur.lastrowid)
+        self._autocommit("Error creating list")
 
     def _removelist(self, node):
         if (node.get_type() != LIST):
@@ -154,6 +389,7 @@ class SQLiteDatabase(Database):
         
         # Find id of list to be deleted
         id = self._get_nodeid(node)
+        key = self._nodekey(node)
 
         # we delete the list from the database
         try:
@@ -162,15 +398,37 @@ class SQLiteDatabase(Database):
         except sqlite.DatabaseError, e:
             raise DatabaseException(
                 "SQLite: Error deleting list from database [%s]" % (e))
+        self._idcache.remove(key)
+        self._forget(id)
 
         # now commit the changes and bob's your uncle
+        self._autocommit("Error committing list removal")
+        
+    def _removetree(self, node):
+        if (node.get_type() != LIST):
+            raise DatabaseInvalidNodeException(
+                "Not a list", node);
+
+        id = self._get_nodeid(node)
+        subtree = self._subtreesql()
         try:
-            self._con.commit()
+            # the id cache keys of the list and everything below it
+            self._cur.execute("SELECT PARENT, DATATYPE, NODENAME FROM "
+                              +self._nodetable+" WHERE ID IN ("+subtree+")",
+                              [id])
+            keys = self._cur.fetchall()
+            self._cur.execute("DELETE FROM "+self._datatable
+                              +" WHERE ID IN ("+subtree+")", [id])
+            self._cur.execute("DELETE FROM "+self._nodetable
+                              +" WHERE ID IN ("+subtree+")", [id])
         except sqlite.DatabaseError, e:
-            self._con.rollback()
             raise DatabaseException(
-                "SQLite: Error committing list removal [%s]" % (e))
-        
+                "SQLite: Error deleting list from database [%s]" % (e))
+        for key in keys:
+            self._idcache.remove(tuple(key))
+        self._forget()
+        self._autocommit("Error committing list removal")
+
     def _listempty(self, node):
         # Find id of list to be deleted
         id = self._get_nodeid(node)
@@ -189,37 +447,253 @@ class SQLiteDatabase(Database):
             raise DatabaseException(
                 "SQLite: Error checking for list children [%s]" % (e))
         
+    def _count(self, node, recursive):
+        id = self._get_nodeid(node)
+        if (recursive):
+            # the subtree includes the list itself
+            sql = "SELECT COUNT(*) - 1 FROM ("+self._subtreesql()+")"
+        else:
+            sql = "SELECT COUNT(*) FROM "+self._nodetable+" WHERE PARENT = ?"
+        try:
+            self._cur.execute(sql, [id])
+            return self._cur.fetchone()[0]
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error counting nodes [%s]" % (e))
+
+    def _du(self, node):
+        id = self._get_nodeid(node)
+        sql = "SELECT COALESCE(SUM(LENGTH(DATA)), 0) FROM "+self._datatable \
+              +" WHERE ID IN ("+self._subtreesql()+")"
+        try:
+            self._cur.execute(sql, [id])
+            return self._cur.fetchone()[0]
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error adding up data sizes [%s]" % (e))
+
     def _list(self, node):
+        return list(self._iterlist(node, 100))
+
+    def _iterlist(self, node, batch):
+        id = self._get_nodeid(node)
+        # a cursor of its own, so the database can be used
+        # while the list is being walked
+        cur = self._con.cursor()
         try:
-            id = self._get_nodeid(node)
             sql = "SELECT NODENAME, DATATYPE FROM "+self._nodetable \
                   +" WHERE PARENT = ?";
-            self._cur.execute(sql, [id])
-            
-            nodes = []
-            row = self._cur.fetchone()
-            while (row != None):
-                nodes.append(DatabaseNode(row[0], node, row[1], True))
-                row = self._cur.fetchone()
-            return nodes
+            cur.execute(sql, [id])
+        except sqlite.DatabaseError, e:
+            cur.close()
+            raise DatabaseException("SQLite: %s" % (e))
+        return self._iterrows(cur, node, batch)
+
+    def _iterrows(self, cur, node, batch):
+        try:
+            rows = cur.fetchmany(batch)
+            while (len(rows) > 0):
+                for row in rows:
+                    yield DatabaseNode(row[0], node, row[1], True)
+                rows = cur.fetchmany(batch)
         except sqlite.DatabaseError, e:
             raise DatabaseException("SQLite: %s" % (e))
+        cur.close()
 
     def _exists(self, node):
+        return self._resolve(node) != None
+
+    def _stat(self, node, types):
+        if (node == None):
+            if (LIST not in types):
+                return None
+            try:
+                self._cur.execute("SELECT COUNT(*) FROM "+self._nodetable
+                                  +" WHERE PARENT = 0")
+                return DatabaseStat(LIST, 0, self._cur.fetchone()[0], 0,
+                                    None)
+            except sqlite.DatabaseError, e:
+                raise DatabaseException(
+                    "SQLite: Error reading node from db [%s]" % (e))
+
+        sql = "SELECT N.DATATYPE, N.ID, (SELECT COUNT(*) FROM " \
+              +self._nodetable+" AS C WHERE C.PARENT = N.ID), " \
+              +"LENGTH(D.DATA) FROM "+self._nodetable+" AS N " \
+              +"LEFT JOIN "+self._datatable+" AS D ON D.ID = N.ID WHERE "
+        parentid = None
+        id = None
+        if (isinstance(node, DatabaseHandle)):
+            id = self._remembered(node)
+        if (id != None):
+            # a handle is found where it is now, it may have moved
+            sql = sql + "N.ID = ?"
+            values = [id]
+        else:
+            # the IN still lets the lookup use the index
+            parentid = self._get_parentid(node)
+            sql = sql + "N.PARENT = ? AND N.NODENAME = ? AND N.DATATYPE " \
+                  +"IN ("+", ".join(["?"] * len(types))+")"
+            values = [parentid, node.get_cryptedname()] + types
         try:
-            sql = "SELECT COUNT(*) FROM "+self._nodetable \
-                  +" WHERE DATATYPE=? AND NODENAME=? AND PARENT=?"
-            values = (node.get_type(), node.get_cryptedname(),
-                      self._get_parentid(node))
             self._cur.execute(sql, values)
-            row = self._cur.fetchone()
-            if (row[0] == 0):
-                return False
-            else:
-                return True
+            rows = self._cur.fetchall()
         except sqlite.DatabaseError, e:
             raise DatabaseException(
-                "SQLite: Error checking existance of node [%s]" % (e))
+                "SQLite: Error reading node from db [%s]" % (e))
+
+        for type in types:
+            for (rowtype, id, children, size) in rows:
+                if (rowtype != type):
+                    continue
+                handle = DatabaseHandle(node, id, type)
+                if (parentid != None):
+                    self._idcache.put((parentid, type,
+                                       node.get_cryptedname()), id)
+                self._remember(handle, id)
+                if (type == PW):
+                    return DatabaseStat(PW, id, 0, size or 0, handle)
+                return DatabaseStat(LIST, id, children, 0, handle)
+        return None
+
+    def _compact(self):
+        try:
+            self._cur.execute("VACUUM")
+        except sqlite.DatabaseError, e:
+            raise DatabaseException("SQLite: Error compacting [%s]" % (e))
+
+    def _flush(self):
+        """Write the in memory copy back to the file, if it has changed."""
+        if (not self._inmemory
+            or self._con.total_changes == self._flushedchanges):
+            return
+        try:
+            self._replacewithcopy(self._filename)
+        except (sqlite.DatabaseError, IOError, OSError), e:
+            raise DatabaseException("SQLite: Error writing back to %s [%s]"
+                                    % (self._filename, e))
+        self._flushedchanges = self._con.total_changes
+        self._lastflush = time.time()
+
+    def _backup(self, dest, pages, progress):
+        """pysqlite has no backup API, so the copy is made by a single
+        VACUUM INTO, and pages is always None. Other connections can read
+        the database while it is made, but can't write to it. With
+        inmemory on, the copy is made from memory and the file isn't
+        locked at all."""
+        try:
+            self._replacewithcopy(dest)
+            size = os.path.getsize(dest)
+        except (sqlite.DatabaseError, IOError, OSError), e:
+            raise DatabaseException("SQLite: Error backing up to %s [%s]"
+                                    % (dest, e))
+        if (progress != None):
+            progress(size, size)
+        return size
+
+    def _replacewithcopy(self, filename):
+        """Replace filename with a copy of the committed database. The
+        copy is written to a new file which then replaces the old one,
+        so filename holds either the old or new copy whatever happens."""
+        newname = filename + ".new"
+        try:
+            if (os.path.exists(newname)):
+                os.remove(newname)
+            self._cur.execute("VACUUM INTO ?", [newname])
+            f = open(newname, "rb")
+            try:
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            os.rename(newname, filename)
+        finally:
+            if (os.path.exists(newname)):
+                os.remove(newname)
+
+    def autotune(self, writes=100, reads=1000, bulk=1000):
+        """Time a short workload under each profile, on a copy of the
+        database next to it, so on the same disk. Single committed
+        puts, gets by name and one put_many of bulk passwords, as the
+        SQL this driver runs for them.
+        Returns (profile, [(profile, seconds), ...]), the profile
+        recommended and the timings, fastest first. bulk-import is
+        timed but never recommended, it is only safe for imports."""
+        if (self._intransaction()):
+            raise DatabaseException("Cannot autotune inside a transaction")
+        copyname = self._filename + ".autotune"
+        timings = []
+        try:
+            try:
+                for profile in sorted(_profiles.keys()):
+                    self._replacewithcopy(copyname)
+                    con = sqlite.connect(copyname)
+                    try:
+                        cur = con.cursor()
+                        self._tune(cur, profile)
+                        timings.append((self._workload(con, cur, writes,
+                                                       reads, bulk),
+                                        profile))
+                    finally:
+                        con.close()
+            except (sqlite.DatabaseError, IOError, OSError), e:
+                raise DatabaseException("SQLite: Error autotuning [%s]"
+                                        % (e))
+        finally:
+            for suffix in ["", "-wal", "-shm", "-journal"]:
+                if (os.path.exists(copyname + suffix)):
+                    os.remove(copyname + suffix)
+        timings.sort()
+        best = [profile for (seconds, profile) in timings
+                if profile in _safeprofiles][0]
+        return (best, [(profile, seconds) for (seconds, profile) in timings])
+
+    def _workload(self, con, cur, writes, reads, bulk):
+        """Run the autotune workload on con, returns the seconds taken"""
+        start = time.time()
+        cur.execute("INSERT INTO "+self._nodetable
+                    +"(DATATYPE, NODENAME, PARENT) VALUES(?, ?, 0)",
+                    (LIST, "autotune"))
+        parentid = cur.lastrowid
+        con.commit()
+        for i in range(writes):
+            cur.execute("INSERT INTO "+self._nodetable
+                        +"(DATATYPE, NODENAME, PARENT) VALUES(?, ?, ?)",
+                        (PW, "w%d" % (i), parentid))
+            cur.execute("INSERT INTO "+self._datatable+" VALUES(?, ?)",
+                        (cur.lastrowid, "x" * 64))
+            con.commit()
+        for i in range(reads):
+            cur.execute("SELECT DATA FROM "+self._nodetable+" INNER JOIN "
+                        +self._datatable+" ON "+self._nodetable+".ID = "
+                        +self._datatable+".ID WHERE PARENT = ? AND"
+                        +" DATATYPE = ? AND NODENAME = ?",
+                        (parentid, PW, "w%d" % (i % writes)))
+            cur.fetchone()
+        cur.executemany("INSERT INTO "+self._nodetable
+                        +"(DATATYPE, NODENAME, PARENT) VALUES(?, ?, ?)",
+                        [(PW, "b%d" % (i), parentid) for i in range(bulk)])
+        cur.execute("INSERT INTO "+self._datatable+" SELECT ID, ? FROM "
+                    +self._nodetable+" WHERE PARENT = ? AND NODENAME"
+                    +" LIKE 'b%'", ("x" * 64, parentid))
+        con.commit()
+        return time.time() - start
+
+    def _tune(self, cur, profile):
+        """Apply a tuning profile to the connection of cur"""
+        for pragma in _profiles[profile]:
+            cur.execute(pragma)
+
+    def _load(self):
+        """Returns a connection to an in memory copy of the file"""
+        con = sqlite.connect(":memory:")
+        if (not os.path.exists(self._filename)):
+            return con
+        # pysqlite has no backup API, the file is loaded as SQL
+        disk = sqlite.connect(self._filename)
+        try:
+            con.executescript("\n".join(disk.iterdump()))
+        finally:
+            disk.close()
+        return con
 
     def _savekey(self, key):
         sql = "UPDATE " + self._keytable + " SET THEKEY = ?"
@@ -255,28 +729,135 @@ class SQLiteDatabase(Database):
                               + " VALUES('')");
             try:
                 self._con.commit()
-            except DatabaseError, e:
+            except sqlite.DatabaseError, e:
                 self._con.rollback()
                 raise e
+        self._migrate()
+
+    def _schemaversion(self):
+        """Returns the schema version of the database"""
+        self._cur.execute("PRAGMA TABLE_INFO("+self._versiontable+")")
+        if (self._cur.fetchone() == None):
+            self._cur.execute("CREATE TABLE " + self._versiontable
+                              + "(VERSION INTEGER NOT NULL)")
+            self._cur.execute("INSERT INTO " + self._versiontable
+                              + " VALUES(0)")
+            self._con.commit()
+        self._cur.execute("SELECT VERSION FROM " + self._versiontable)
+        return self._cur.fetchone()[0]
+
+    def _migrate(self):
+        """Upgrade the database to the latest schema version,
+        applying each migration it is missing in order."""
+        tables = {'nodes': self._nodetable,
+                  'data': self._datatable,
+                  'keys': self._keytable}
+        version = self._schemaversion()
+        if (version > len(_migrations)):
+            raise DatabaseException(
+                "SQLite: database schema version %d is newer than %d"
+                % (version, len(_migrations)))
+        # migrations may rebuild tables which are referenced by others,
+        # and foreign keys can't be switched off inside a transaction
+        self._cur.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for i in range(version, len(_migrations)):
+                script = "BEGIN;\n%s\nUPDATE %s SET VERSION = %d;\nCOMMIT;" \
+                         % (_migrations[i] % tables, self._versiontable, i+1)
+                try:
+                    self._cur.executescript(script)
+                except sqlite.DatabaseError, e:
+                    # pysqlite doesn't know about the script's BEGIN,
+                    # so its rollback() would leave the vault locked
+                    try:
+                        self._cur.execute("ROLLBACK")
+                    except sqlite.DatabaseError:
+                        # the script failed before its BEGIN
+                        pass
+                    raise DatabaseException(
+                        "SQLite: Error upgrading schema to version %d [%s]"
+                        % (i+1, e))
+        finally:
+            self._cur.execute("PRAGMA foreign_keys = ON")
+
+    def _begin(self):
+        # pysqlite opens a transaction itself before the first
+        # statement which modifies the database, all we need to do
+        # is hold off committing until _commit is called
+        pass
+
+    def _commit(self, message="Error committing transaction"):
+        try:
+            self._con.commit()
+        except sqlite.DatabaseError, e:
+            self._rollback()
+            raise DatabaseException("SQLite: %s [%s]" % (message, e))
+        if (self._inmemory and self._flushinterval > 0
+            and time.time() - self._lastflush >= self._flushinterval):
+            self._flush()
+
+    def _rollback(self):
+        """Roll back the connection. Ids of rows created since the last
+        commit may now be gone, so the id cache is emptied."""
+        self._con.rollback()
+        self._idcache.clear()
+        self._forget()
+
+    def _autocommit(self, message):
+        """Commit the last operation, unless it is part of a
+        transaction in which case it is left for _commit."""
+        if (not self._intransaction()):
+            self._commit(message)
+
+    def _nodekey(self, node):
+        """Returns the id cache key of a node, ie the tuple
+        (parent id, type, crypted name)"""
+        if (isinstance(node, DatabaseHandle)):
+            # the path of a handle is out of date if its node has
+            # been moved, the row knows where it is
+            id = self._resolve(node)
+            if (id != None):
+                try:
+                    self._cur.execute("SELECT PARENT, DATATYPE, NODENAME"
+                                      +" FROM "+self._nodetable
+                                      +" WHERE ID = ?", [id])
+                    row = self._cur.fetchone()
+                except sqlite.DatabaseError, e:
+                    raise DatabaseException(
+                        "SQLite: Error finding node [%s]" % (e))
+                if (row != None):
+                    return tuple(row)
+        return (self._get_parentid(node), node.get_type(),
+                node.get_cryptedname())
+
+    def _childids(self, parentid, type, names):
+        """Returns a dictionary mapping those of the crypted names
+        which exist in list parentid to their ids, and adds them to
+        the id cache. The names are looked up in a single query."""
+        if (len(names) == 0):
+            return {}
+        sql = "SELECT NODENAME, ID FROM "+self._nodetable \
+              +" WHERE PARENT = ? AND DATATYPE = ? AND NODENAME IN (" \
+              +", ".join(["?"] * len(names))+")"
+        try:
+            self._cur.execute(sql, [parentid, type] + list(names))
+            ids = dict(self._cur.fetchall())
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error getting node ids [%s]" % (e))
+        for (name, id) in ids.items():
+            self._idcache.put((parentid, type, name), id)
+        return ids
 
     def _get_nodeid(self, node):
         """Returns the id of a node"""
         if (node == None):
             return 0
-        
-        sql = "SELECT ID FROM "+self._nodetable \
-              +" WHERE DATATYPE = ? AND NODENAME = ? AND PARENT = ?"
-        values = (node.get_type(), node.get_cryptedname(),
-                  self._get_parentid(node))
-        try:
-            self._cur.execute(sql, values)
-            id = self._cur.fetchone()
-            if (id == None):
-                raise DatabaseNoSuchNodeException(
-                    "Node does not exist", node)
-        except sqlite.DatabaseError, e:
-            raise DatabaseException(
-                "SQLite: Error getting node id [%s]" % (e))
+
+        id = self._resolve(node)
+        if (id == None):
+            raise DatabaseNoSuchNodeException(
+                "Node does not exist", node)
         return id
 
     def _get_parentid(self, node):
@@ -284,18 +865,185 @@ class SQLiteDatabase(Database):
         parent = node.get_parent()
         if (parent == None):
             return 0
-        parentid = self._get_parentid(parent)
+        parentid = self._resolve(parent)
+        if (parentid == None):
+            raise DatabaseNoSuchNodeException(
+                "Path does not exist", node)
+        return parentid
+
+    def _cachedid(self, node):
+        """Returns the id of a node if it can be found without
+        touching the database, or None."""
+        (id, chain) = self._unresolved(node)
+        for n in chain:
+            id = self._idcache.get((id, n.get_type(), n.get_cryptedname()))
+            if (id == None):
+                return None
+        return id
+
+    def _resolve(self, node):
+        """Returns the id of a node, or None if it doesn't exist.
+        Raises DatabaseNoSuchNodeException if one of its parents
+        doesn't exist."""
+        (id, chain) = self._unresolved(node)
+
+        # follow the id cache as far down as it goes, and fetch
+        # the rest of the chain from the database in one go
+        for i in range(len(chain)):
+            key = (id, chain[i].get_type(), chain[i].get_cryptedname())
+            cached = self._idcache.get(key)
+            if (cached == None):
+                return self._resolvechain(id, chain[i:])
+            id = cached
+            self._remember(chain[i], id)
+        return id
+
+    def _unresolved(self, node):
+        """Returns (id, chain). chain is node and those of its
+        ancestors whose ids aren't remembered, starting at the root,
+        and id is the id of the parent of chain[0]."""
+        chain = []
+        while (node != None):
+            id = self._remembered(node)
+            if (id != None):
+                break
+            chain.append(node)
+            node = node.get_parent()
+        else:
+            id = 0
+        chain.reverse()
+        return (id, chain)
+
+    def _remember(self, node, id):
+        """Remember the id of a node object, so it can be found
+        again without walking down its path."""
+        self._nodeids[node] = id
+
+    def _remembered(self, node):
+        """Returns the id remembered for a node object, or None if
+        there is none or it may no longer be right. The id a handle
+        carries is checked against the database the first time."""
+        id = self._nodeids.get(node)
+        if (id == None and isinstance(node, DatabaseHandle)
+            and node.get_id() != None):
+            id = self._checkhandle(node)
+        if (id in self._deadids):
+            return None
+        return id
+
+    def _checkhandle(self, handle):
+        """Returns the id of a handle if its row is still there and
+        remembers it, otherwise None so it is found by path."""
         try:
-            self._cur.execute("SELECT ID FROM "+self._nodetable+" WHERE"
-                              +" DATATYPE = ? AND NODENAME=? AND PARENT=?",
-                              (parent.get_type(), parent.get_cryptedname(), parentid))
+            self._cur.execute("SELECT ID FROM "+self._nodetable
+                              +" WHERE ID = ? AND DATATYPE = ?",
+                              (handle.get_id(), handle.get_type()))
             row = self._cur.fetchone()
-            if (row == None):
-                raise DatabaseNoSuchNodeException(
-                    "Path does not exist", node)
-            parentid = row[0]
         except sqlite.DatabaseError, e:
             raise DatabaseException(
-                "SQLite: Error finding parent id [%s]" %(e))
+                "SQLite: Error finding node [%s]" % (e))
+        if (row == None):
+            return None
+        self._remember(handle, row[0])
+        return row[0]
+
+    def _forget(self, id=None):
+        """Invalidate remembered ids, either the one of a node which
+        has been deleted, or when nodes have moved or been removed
+        wholesale, all of them."""
+        if (id == None):
+            self._nodeids = weakref.WeakKeyDictionary()
+            self._deadids = set()
+        else:
+            self._deadids.add(id)
+
+    def _resolvechain(self, parentid, chain):
+        """Resolve chain, where chain[0] is a child of parentid and
+        every other node is a child of the one before it. A chain of
+        fewer than _shortchain nodes is walked one query per level,
+        longer ones cost a single query per chunk, a recursive walk
+        down NODES matching one component per level. The ids found
+        along the way are added to the id cache. Returns the id of the
+        last node in chain, or None if only that one is missing."""
+        for start in range(0, len(chain), self._chainchunk):
+            chunk = chain[start:start+self._chainchunk]
+            if (len(chunk) < self._shortchain):
+                rows = self._walkchain(parentid, chunk)
+            else:
+                rows = self._querychain(parentid, chunk)
+            for (depth, id) in rows:
+                n = chunk[depth-1]
+                self._idcache.put((parentid, n.get_type(),
+                                   n.get_cryptedname()), id)
+                self._remember(n, id)
+                parentid = id
+            if (len(rows) < len(chunk)):
+                if (start + len(rows) == len(chain) - 1):
+                    return None
+                raise DatabaseNoSuchNodeException(
+                    "Path does not exist", chain[-1])
         return parentid
-            
+
+    def _walkchain(self, parentid, chunk):
+        """Returns (depth, id) for the nodes of chunk which exist,
+        looking them up one level at a time."""
+        rows = []
+        try:
+            for n in chunk:
+                self._cur.execute("SELECT ID FROM "+self._nodetable
+                                  +" WHERE DATATYPE = ? AND NODENAME = ?"
+                                  +" AND PARENT = ?",
+                                  (n.get_type(), n.get_cryptedname(),
+                                   parentid))
+                row = self._cur.fetchone()
+                if (row == None):
+                    break
+                parentid = row[0]
+                rows.append((len(rows)+1, parentid))
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error finding node id [%s]" %(e))
+        return rows
+
+    def _querychain(self, parentid, chunk):
+        """Returns (depth, id) for the nodes of chunk which exist,
+        found with the single query from _chainsql."""
+        values = []
+        for n in chunk:
+            values.extend([n.get_type(), n.get_cryptedname()])
+        values.append(parentid)
+        # pysqlite commits any open transaction before statements
+        # which do not start with SELECT, so keep the WITH inside
+        try:
+            self._cur.execute(self._chainsql(len(chunk)), values)
+            rows = self._cur.fetchall()
+        except sqlite.DatabaseError, e:
+            raise DatabaseException(
+                "SQLite: Error finding node id [%s]" %(e))
+        rows.sort()
+        return rows
+
+    def _subtreesql(self):
+        """Returns a query for the ids of a node and everything below
+        it, taking the id of the node as its parameter."""
+        # pysqlite commits any open transaction before statements
+        # which do not start with SELECT, so keep the WITH inside
+        return "SELECT ID FROM (WITH RECURSIVE SUBTREE(ID) AS " \
+               +"(SELECT ? UNION ALL SELECT N.ID FROM " \
+               +self._nodetable+" AS N JOIN SUBTREE " \
+               +"ON N.PARENT = SUBTREE.ID) SELECT ID FROM SUBTREE)"
+
+    def _chainsql(self, length):
+        """Returns the query used by _querychain for a chain of
+        length nodes. Parameters are the type and crypted name of each
+        node in turn, followed by the id of the first node's parent."""
+        return "SELECT DEPTH, ID FROM (WITH RECURSIVE " \
+               +"PATH(DEPTH, DATATYPE, NODENAME) AS (VALUES " \
+               +", ".join(["(%d, ?, ?)" % (i+1) for i in range(length)]) \
+               +"), WALK(DEPTH, ID) AS (SELECT 0, ? UNION ALL " \
+               +"SELECT PATH.DEPTH, N.ID FROM WALK " \
+               +"JOIN PATH ON PATH.DEPTH = WALK.DEPTH + 1 " \
+               +"JOIN "+self._nodetable+" AS N ON N.PARENT = WALK.ID " \
+               +"AND N.DATATYPE = PATH.DATATYPE " \
+               +"AND N.NODENAME = PATH.NODENAME) " \
+               +"SELECT DEPTH, ID FROM WALK WHERE DEPTH > 0)"
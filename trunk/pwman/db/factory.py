@@ -2,14 +2,31 @@
 
 Usage:
 
-import pwlib.db.DatabaseFactory as DBFactory
+import pwman.db.factory
 
-db = DBFactory.create(params)
+db = pwman.db.factory.create(params)
 db.open()
 .....
+
+Drivers are looked up by the 'type' param. Other drivers can be added
+with register(), or by packages declaring an entry point in the
+'pwman.db.drivers' group, named after the type:
+
+pwman.db.factory.register("MyDB", "mypackage.mydb", "MyDatabase")
 """
 from pwman.db.database import Database, DatabaseException
-from pwman.db.drivers import sqlite
+import sys
+
+# maps each database type to the module and class of its driver.
+# The module is only imported when a database of that type is created.
+_drivers = {'SQLite': ('pwman.db.drivers.sqlite', 'SQLiteDatabase'),
+            'Memory': ('pwman.db.drivers.memory', 'MemoryDatabase'),
+            'BerkeleyDB': ('pwman.db.drivers.berkeley', 'BerkeleyDatabase'),
+            'Log': ('pwman.db.drivers.log', 'LogDatabase')}
+
+# entry point group searched for types which aren't registered
+_entrypointgroup = 'pwman.db.drivers'
+_entrypointsloaded = False
 
 def create(params):
     """
@@ -17,18 +34,59 @@ def create(params):
     Create a Database instance. `params` is a dictionary.
     The only key used by this function is 'type'. All others are passed
     on to the __init__ method of the Database instance.
-    'type' can only be 'SQLite' at the moment
+    'type' can be 'SQLite', 'BerkeleyDB' for a dbm file, 'Log' for
+    an append only file, 'Memory' for a database which is never
+    written to disk, or any type which has been registered
     """
     try:
         type = params['Database']['type']
     except KeyError:
         raise DatabaseException("No Database type specified")
 
-    if type == "BerkeleyDB":
-        pass
-#        db = BerkeleyDatabase.BerkeleyDatabase(params)
-    elif (type == "SQLite"):
-        db = sqlite.SQLiteDatabase(params)
-    else:
-        raise DatabaseException("Unknown database type specified")
+    db = getdriver(type)(params)
     return db
+
+def register(type, module, classname):
+    """Register the driver for databases of type `type`: class
+    `classname` in module `module`. The module is imported when a
+    database of that type is first created. Replaces any driver
+    already registered for type."""
+    _drivers[type] = (module, classname)
+
+def getdriver(type):
+    """Returns the driver class for databases of type `type`, importing
+    its module if need be. Raises DatabaseException if there is no
+    such type or its module can't be imported."""
+    if (not _drivers.has_key(type)):
+        _loadentrypoints()
+    try:
+        (module, classname) = _drivers[type]
+    except KeyError:
+        raise DatabaseException("Unknown database type specified")
+
+    try:
+        __import__(module)
+        driver = sys.modules[module]
+        for name in classname.split("."):
+            driver = getattr(driver, name)
+    except ImportError, e:
+        raise DatabaseException("Cannot load %s driver [%s]" % (type, e))
+    except AttributeError, e:
+        raise DatabaseException("Cannot load %s driver [%s]" % (type, e))
+    return driver
+
+def _loadentrypoints():
+    """Register the drivers declared as entry points, if setuptools
+    is installed. Drivers registered with register() take precedence.
+    Only done once, and only when a type isn't known."""
+    global _entrypointsloaded
+    if (_entrypointsloaded):
+        return
+    _entrypointsloaded = True
+    try:
+        import pkg_resources
+    except ImportError:
+        return
+    for entry in pkg_resources.iter_entry_points(_entrypointgroup):
+        if (not _drivers.has_key(entry.name)):
+            _drivers[entry.name] = (entry.module_name, ".".join(entry.attrs))
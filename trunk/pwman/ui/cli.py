@@ -11,6 +11,7 @@ import tty
 import os
 import getpass
 import cmd
+import time
 
 try:
     import readline
@@ -80,7 +81,9 @@ class PwmanCli(cmd.Cmd):
         
     def do_edit(self, arg):
         try:
-            password = self._db.get(arg)
+            # found once, read and written back by id
+            node = self._db.open_node(arg, PW)
+            password = self._db.get(node)
             if (not isinstance(password, Password)):
                 return
             menu = CliMenu()
@@ -97,7 +100,7 @@ class PwmanCli(cmd.Cmd):
                                  password.get_notes,
                                  password.set_notes))
             menu.run()
-            self._db.put(arg, password)
+            self._db.put(node, password)
         except Exception, e:
             self.error(e)
     
@@ -110,10 +113,14 @@ class PwmanCli(cmd.Cmd):
             nodename = self.get_nodename()
             
             password = Password(username, password, url, notes)
-            if (self._db.exists(nodename)):
+            stat = self._db.stat(nodename, PW)
+            if (stat == None):
+                node = nodename
+            else:
+                node = stat.get_node()
                 if (not getyesno("Password already exists. Overwrite?")):
                     return
-            self._db.put(nodename, password)
+            self._db.put(node, password)
         except EOFError:
             self.do_exit()
         except Exception, e:
@@ -121,11 +128,18 @@ class PwmanCli(cmd.Cmd):
         
     def do_show(self, arg):
         try:
-            node = self._db.get(arg)
-            if (isinstance(node, Password)):
-                self.print_node(node)
+            stat = self._db.stat(arg)
+            if (stat == None):
+                print "No such password or list: %s" % (arg)
+            elif (stat.get_type() == LIST):
+                print typeset("%s/" % (arg.rstrip("/")), ANSI.Blue, True),
+                print "(%d entries)" % (stat.get_children())
             else:
-                print node
+                node = self._db.get(stat.get_node())
+                if (isinstance(node, Password)):
+                    self.print_node(node)
+                else:
+                    print node
         except Exception, e:
             self.error(e)
         
@@ -137,18 +151,82 @@ class PwmanCli(cmd.Cmd):
         
     def do_list(self, args):
         try:
-            nodelist = self._db.list()
-            for i in nodelist:
+            for i in self._db.list(order='type'):
                 if (i.get_type() == LIST):
                     print typeset("%s/" % (i.get_name()),
                                        ANSI.Blue, True)
-            for i in nodelist:
-                if (i.get_type() == PW):
+                else:
                     print typeset("%s" % (i.get_name()),
                                        ANSI.Yellow, False)
         except CryptoBadKeyException, e:
             self.error(e)
 
+    def do_count(self, args):
+        try:
+            path = args.strip() or None
+            print "%d entries, %d in all, %d bytes" % (
+                self._db.count(path), self._db.count(path, True),
+                self._db.du(path))
+        except Exception, e:
+            self.error(e)
+
+    def do_compact(self, args):
+        try:
+            self._db.compact()
+        except Exception, e:
+            self.error(e)
+
+    def do_flush(self, args):
+        try:
+            self._db.flush()
+        except Exception, e:
+            self.error(e)
+
+    def do_backup(self, args):
+        args = args.split()
+        steps = self._db.backup_in_steps()
+        if (len(args) < 1 or len(args) > 1 + int(steps)):
+            if (steps):
+                print "Usage: backup <file> [pages per step]"
+            else:
+                print "Usage: backup <file>"
+            return
+        start = time.time()
+        def progress(done, total):
+            elapsed = max(time.time() - start, 0.001)
+            print "\r%3d%% %8.1f KB/s" % (done * 100 / max(total, 1),
+                                          done / 1024.0 / elapsed),
+            sys.stdout.flush()
+        try:
+            if (not steps):
+                # copied in one go, there is no progress to show
+                size = self._db.backup(args[0])
+            else:
+                if (len(args) == 2):
+                    size = self._db.backup(args[0], int(args[1]), progress)
+                else:
+                    size = self._db.backup(args[0], progress=progress)
+                print
+            print "Backed up %d bytes to %s in %.2fs" % (
+                size, args[0], time.time() - start)
+        except Exception, e:
+            if (steps):
+                print
+            self.error(e)
+
+    def do_autotune(self, args):
+        if (not hasattr(self._db, "autotune")):
+            print "This database has no tuning profiles"
+            return
+        try:
+            (best, timings) = self._db.autotune()
+            for (profile, seconds) in timings:
+                print "%-12s %8.1fms" % (profile, seconds * 1000)
+            print "Recommended: profile = %s in the [Database] section" % (
+                best)
+        except Exception, e:
+            self.error(e)
+
     def postcmd(self, stop, line):
         self.updateprompt()
         return False
@@ -187,7 +265,7 @@ def getonechar(question, width=_defaultwidth):
     print ch
     return ch
     
-def getyesno(defaultyes=False, width=_defaultwidth):
+def getyesno(question, defaultyes=False, width=_defaultwidth):
     if (defaultyes):
         default = "[Y/n]"
     else:
@@ -0,0 +1,94 @@
+"""Bounded least recently used cache.
+
+Usage:
+from pwman.util.cache import LRUCache
+
+cache = LRUCache(100)
+cache.put("key", value)
+value = cache.get("key")
+print cache.stats()['hitrate']
+"""
+
+class LRUCache:
+    """Maps keys to values, holding at most `maxsize` entries. When
+    full, the entry which was used the longest time ago is dropped.
+    Counts hits and misses of get()."""
+    def __init__(self, maxsize):
+        """Initialise an empty cache which holds up to maxsize entries."""
+        self._maxsize = maxsize
+        self._hits = 0
+        self._misses = 0
+        self.clear()
+
+    def get(self, key, default=None, count=True):
+        """Return the value for key and mark it as recently used,
+        or default if key isn't in the cache. If count is False the
+        lookup isn't counted in the statistics."""
+        link = self._links.get(key)
+        if (link == None):
+            if (count):
+                self._misses += 1
+            return default
+        if (count):
+            self._hits += 1
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+
+    def put(self, key, value):
+        """Store value under key, dropping the least recently used
+        entry if the cache is full."""
+        link = self._links.get(key)
+        if (link != None):
+            self._unlink(link)
+            del self._links[key]
+        elif (len(self._links) >= self._maxsize):
+            oldest = self._root[1]
+            if (oldest is self._root):
+                return
+            self._unlink(oldest)
+            del self._links[oldest[2]]
+        link = [None, None, key, value]
+        self._append(link)
+        self._links[key] = link
+
+    def remove(self, key):
+        """Drop the entry for key, if there is one."""
+        link = self._links.pop(key, None)
+        if (link != None):
+            self._unlink(link)
+
+    def clear(self):
+        """Drop all entries. The statistics are kept."""
+        # links are [previous, next, key, value], in a circular list
+        # running from least to most recently used through _root
+        self._root = [None, None, None, None]
+        self._root[0] = self._root
+        self._root[1] = self._root
+        self._links = {}
+
+    def stats(self):
+        """Return a dictionary with the number of hits and misses,
+        the hit rate, and the current and maximum size."""
+        lookups = self._hits + self._misses
+        if (lookups == 0):
+            hitrate = 0.0
+        else:
+            hitrate = float(self._hits) / lookups
+        return {'hits': self._hits, 'misses': self._misses,
+                'hitrate': hitrate, 'size': len(self._links),
+                'maxsize': self._maxsize}
+
+    def __len__(self):
+        return len(self._links)
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _append(self, link):
+        last = self._root[0]
+        link[0] = last
+        link[1] = self._root
+        last[1] = link
+        self._root[0] = link
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+#
+# Backs up a database with a password list in it, a few pages at a
+# time where the driver copies in steps, and checks the copy opens and
+# holds what was there when the backup was made. Drivers which copy
+# in one step (SQLite) must refuse a number of pages per step. For
+# each driver that supports backup:
+#     backup_test.py [driver ...]
+#
+from pwman.db.database import DatabaseException
+import glob
+import os
+import sys
+import pwman.db.factory
+
+filename = '/tmp/test_backup.db'
+dest = '/tmp/test_backup.copy'
+drivers = sys.argv[1:] or ['SQLite', 'Log']
+
+def create(type, filename):
+    db = pwman.db.factory.create({'Database': {'type': type,
+                                               'filename': filename}})
+    db.open()
+    return db
+
+for type in drivers:
+    for f in glob.glob(filename + "*") + glob.glob(dest + "*"):
+        os.remove(f)
+
+    db = create(type, filename)
+    try:
+        db.makelist("/list")
+        db.put_many([("/list/e%d" % (i), "password%d" % (i) * 10)
+                     for i in range(3000)])
+        steps = []
+        record = lambda done, total: steps.append((done, total))
+        if (db.backup_in_steps()):
+            size = db.backup(dest, 4, record)
+        else:
+            try:
+                db.backup(dest, 4, record)
+                raise AssertionError("pages per step not refused")
+            except DatabaseException, e:
+                print "Refused: %s" % (e)
+            size = db.backup(dest, progress=record)
+        assert steps[-1] == (size, size), steps[-1]
+        db.put("/list/after", "AfterData")
+    finally:
+        db.close()
+
+    db = create(type, dest)
+    try:
+        assert db.count("/list") == 3000
+        assert db.get("/list/e2999") == "password2999" * 10
+        assert not db.exists("/list/after")
+    finally:
+        db.close()
+    print "%s: %d bytes in %d steps: ok" % (type, size, len(steps))
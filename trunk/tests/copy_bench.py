@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#
+# Time copying a 10k entry list, and count the encryptions and
+# decryptions it costs.
+#
+import os
+import time
+import pwman.db.factory
+from pwman.util.crypto import CryptoEngine
+
+params = {'Database': {'type': 'SQLite',
+                       'filename':'/tmp/copy_bench.db'}
+          }
+
+entries = 10000
+
+class CountingCrypto:
+    """Wraps the CryptoEngine, counting calls to encrypt and decrypt"""
+    def __init__(self, crypto):
+        self.crypto = crypto
+        self.encrypted = 0
+        self.decrypted = 0
+
+    def encrypt(self, obj):
+        self.encrypted += 1
+        return self.crypto.encrypt(obj)
+
+    def decrypt(self, ciphertext):
+        self.decrypted += 1
+        return self.crypto.decrypt(ciphertext)
+
+    def __getattr__(self, name):
+        return getattr(self.crypto, name)
+
+if os.path.exists(params['Database']['filename']):
+    os.remove(params['Database']['filename'])
+
+db = pwman.db.factory.create(params)
+db.open()
+try:
+    db.makelist("/source")
+    db.put_many([("/source/entry%d" % (i), "password%d" % (i))
+                 for i in range(entries)])
+
+    crypto = CountingCrypto(CryptoEngine.get())
+    CryptoEngine._instance = crypto
+    db._crypto = crypto
+
+    start = time.time()
+    db.copy("/source", "/dest")
+    elapsed = time.time() - start
+
+    print "copied %d entries in %.2fs" % (entries, elapsed)
+    print "encryptions: %d" % (crypto.encrypted)
+    print "decryptions: %d" % (crypto.decrypted)
+finally:
+    db.close()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+#
+# Compare the drivers on a list of n passwords: filling it with
+# put_many, single puts, gets, and walking the list.
+# Sizes and drivers can be given on the command line:
+#     driver_bench.py [n ...] [-d driver,driver]
+#
+import glob
+import os
+import random
+import sys
+import time
+import pwman.db.factory
+
+filename = '/tmp/driver_bench.db'
+sizes = [1000, 10000, 100000]
+drivers = ['SQLite', 'BerkeleyDB', 'Log', 'Memory']
+args = sys.argv[1:]
+if ('-d' in args):
+    i = args.index('-d')
+    drivers = args[i+1].split(",")
+    args = args[:i] + args[i+2:]
+if (len(args) > 0):
+    sizes = [int(n) for n in args]
+
+# operations timed one at a time, each is committed on its own
+singleputs = 100
+gets = 1000
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+def fill(db, n):
+    db.put_many([("/bench/e%d" % (i), "password%d" % (i))
+                 for i in range(n)])
+
+def put(db, paths):
+    for path in paths:
+        db.put(path, "changed")
+
+def get(db, paths):
+    for path in paths:
+        db.get(path)
+
+def walk(db):
+    for node in db.iterlist("/bench"):
+        pass
+
+def bench(type, n):
+    for f in glob.glob(filename + "*"):
+        os.remove(f)
+    db = pwman.db.factory.create({'Database': {'type': type,
+                                               'filename': filename}})
+    db.open()
+    try:
+        db.makelist("/bench")
+        results = [timed(fill, db, n) / n]
+        paths = ["/bench/e%d" % (random.randrange(n))
+                 for i in range(singleputs)]
+        results.append(timed(put, db, paths) / singleputs)
+        paths = ["/bench/e%d" % (random.randrange(n)) for i in range(gets)]
+        results.append(timed(get, db, paths) / gets)
+        results.append(timed(walk, db) / n)
+    finally:
+        db.close()
+    return results
+
+print "%-12s %9s %12s %12s %12s %12s" % ("driver", "n", "put_many",
+                                         "put", "get", "iterlist")
+for n in sizes:
+    for type in drivers:
+        results = bench(type, n)
+        print "%-12s %9d" % (type, n),
+        print " ".join(["%9.1fus" % (t * 1000000) for t in results])
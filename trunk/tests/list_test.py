@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#
+# Checks Database.list: paging with after in both orders, and that
+# the sorted lists it keeps are dropped when a list changes, by put,
+# delete, move, a rolled back transaction or a handle on a node which
+# has been moved. For each driver:
+#     list_test.py [driver ...]
+#
+from __future__ import with_statement
+from pwman.db.database import LIST, PW
+import glob
+import os
+import sys
+import pwman.db.factory
+
+filename = '/tmp/test_list.db'
+drivers = sys.argv[1:] or ['SQLite', 'Memory', 'Log', 'BerkeleyDB']
+
+def names(nodes):
+    return [node.get_name() for node in nodes]
+
+def pages(db, path, limit, order):
+    """Returns the names in list path, fetched limit at a time"""
+    result = []
+    page = db.list(path, limit, None, order)
+    while (len(page) > 0):
+        result.extend(names(page))
+        page = db.list(path, limit, page[-1], order)
+    return result
+
+for type in drivers:
+    for f in glob.glob(filename + "*"):
+        os.remove(f)
+    db = pwman.db.factory.create({'Database': {'type': type,
+                                               'filename': filename}})
+    db.open()
+    try:
+        db.makelist("/l")
+        db.put_many([("/l/p%02d" % (i), "data") for i in range(25)])
+        for i in range(5):
+            db.makelist("/l/l%02d" % (i))
+        # a list and a password of the same name
+        db.put("/l/l00", "data")
+
+        byname = sorted(["p%02d" % (i) for i in range(25)]
+                        + ["l%02d" % (i) for i in range(5)] + ["l00"])
+        assert pages(db, "/l", 7, 'name') == byname
+        bytype = ["l%02d" % (i) for i in range(5)] + ["l00"] \
+                 + ["p%02d" % (i) for i in range(25)]
+        assert pages(db, "/l", 4, 'type') == bytype
+        assert [node.get_type() for node in db.list("/l", 2)] == [LIST, PW]
+
+        # a page carries on after a node which has gone
+        page = db.list("/l", 3)
+        db.removelist("/l/l01")
+        assert names(db.list("/l", 2, page[-1])) == ["l02", "l03"]
+
+        db.put("/l/a", "data")
+        assert names(db.list("/l", 1)) == ["a"]
+        db.delete("/l/a")
+        assert names(db.list("/l", 1)) == ["l00"]
+        page = db.list("/l", 4, None, 'type')
+        assert [node.get_type() for node in
+                db.list("/l", 2, page[-1], 'type')] == [PW, PW]
+
+        db.move("/l/p01", "/l/b")
+        assert names(db.list("/l", 1)) == ["b"]
+        db.makelist("/m")
+        db.move("/l/b", "/m")
+        assert names(db.list("/l", 1)) == ["l00"]
+        assert names(db.list("/m")) == ["b"]
+
+        try:
+            with db.transaction():
+                db.put("/l/a", "data")
+                assert names(db.list("/l", 1)) == ["a"]
+                raise ValueError("roll back")
+        except ValueError:
+            pass
+        assert names(db.list("/l", 1)) == ["l00"]
+
+        # a handle keeps its path from before the move
+        db.put("/l/new", "data")
+        handle = db.open_node("/l/new", PW)
+        db.move("/l", "/n")
+        assert "new" in names(db.list("/n"))
+        db.delete(handle)
+        assert "new" not in names(db.list("/n"))
+    finally:
+        db.close()
+    print "%s: ok" % (type)
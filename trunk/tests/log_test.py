@@ -0,0 +1,130 @@
+#!/usr/bin/python
+#
+# Checks the log driver gets back what was committed when it is
+# reopened: from the log alone, from a checkpoint, after a write
+# that was cut short, after commits that failed, and after the log
+# has been compacted.
+#
+from pwman.db.database import DatabaseException
+from pwman.util.crypto import CryptoBadKeyException, CryptoPasswordMismatchException
+import glob
+import os
+import pwman.db.factory
+
+realfsync = os.fsync
+
+filename = '/tmp/test.log'
+params = {'Database': {'type': 'Log',
+                       'filename': filename}
+          }
+
+def reopen(db, replay=False):
+    db.close()
+    if (replay):
+        os.remove(filename + ".checkpoint")
+    db = pwman.db.factory.create(params)
+    db.open()
+    return db
+
+class FailingFile:
+    """Stands in for the log file, the next write only writes part
+    of what it is given and fails"""
+    def __init__(self, f):
+        self._f = f
+    def write(self, s):
+        self._f.write(s[:len(s) / 2])
+        raise IOError("No space left on device")
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+def failsync(fd):
+    """Fails once, then syncs as usual"""
+    os.fsync = realfsync
+    raise OSError("No space left on device")
+
+def check(db, what):
+    assert db.get("/Foobar") == "Foobar1Data", what
+    assert db.get("/FoobarList/FoobarSub") == "FoobarSub2Data", what
+    assert db.get("/Moved/FoobarSub3") == "FoobarSub3Data", what
+    assert not db.exists("/Foobar2"), what
+    assert db.count("/", True) == 5, what
+    print "%s: ok" % (what)
+
+for f in glob.glob(filename + "*"):
+    os.remove(f)
+
+db = pwman.db.factory.create(params)
+try:
+    db.open()
+except CryptoPasswordMismatchException, e:
+    print "Passwords do not match"
+except CryptoBadKeyException, e:
+    print "Bad password"
+
+try:
+    db.put("Foobar", "Foobar1Data")
+    db.put("Foobar2", "Foobar2Data")
+    db.makelist("FoobarList")
+    db.put("/FoobarList/FoobarSub", "FoobarSubData")
+    db.put("/FoobarList/FoobarSub", "FoobarSub2Data")
+    db.makelist("/FoobarList/Sub")
+    db.put("/FoobarList/Sub/FoobarSub3", "FoobarSub3Data")
+    db.move("/FoobarList/Sub", "/Moved")
+    db.delete("Foobar2")
+    check(db, "written")
+
+    db = reopen(db, True)
+    check(db, "replayed")
+
+    db = reopen(db)
+    check(db, "from checkpoint")
+
+    # a transaction cut short, without its commit record
+    db.close()
+    size = os.path.getsize(filename)
+    db = pwman.db.factory.create(params)
+    db.open()
+    db.put("/Lost", "LostData")
+    db.close()
+    f = open(filename, "r+b")
+    f.truncate(os.path.getsize(filename) - 3)
+    f.close()
+    db = pwman.db.factory.create(params)
+    db.open()
+    assert not db.exists("/Lost")
+    assert os.path.getsize(filename) == size
+    check(db, "cut short")
+
+    # commits which fail must not come back, or hide later ones
+    os.fsync = failsync
+    try:
+        db.put("/Failed", "FailedData")
+        raise AssertionError("commit did not fail")
+    except DatabaseException, e:
+        pass
+    logfile = db._file
+    db._file = FailingFile(logfile)
+    try:
+        db.put("/Failed", "FailedData")
+        raise AssertionError("commit did not fail")
+    except DatabaseException, e:
+        pass
+    db._file = logfile
+    db.put("/Kept", "KeptData")
+    assert not db.exists("/Failed")
+    db = reopen(db, True)
+    assert not db.exists("/Failed")
+    assert db.get("/Kept") == "KeptData"
+    db.delete("/Kept")
+    check(db, "failed commits")
+
+    before = os.path.getsize(filename)
+    db.compact()
+    assert os.path.getsize(filename) < before
+    check(db, "compacted")
+    db = reopen(db)
+    check(db, "compacted and reopened")
+    db = reopen(db, True)
+    check(db, "compacted and replayed")
+finally:
+    db.close()
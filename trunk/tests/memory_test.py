@@ -0,0 +1,106 @@
+#!/usr/bin/python
+#
+# The operations of sqlite_test.py on the in memory driver, which
+# needs no file and asks for no password. Also checks that a
+# transaction which fails is undone, nested or not.
+#
+from __future__ import with_statement
+from pwman.db.database import DatabaseException, DatabaseCopyException
+import pwman.db.factory
+
+params = {'Database': {'type': 'Memory'}}
+
+def printlist(node, prefix=""):
+    nodelist = db.list(node.__str__())
+    for node in nodelist:
+        print prefix+"Name: " + node.get_name() + "\tType: " + node.get_type()
+        if (node.get_type() == pwman.db.database.LIST):
+            printlist(node, prefix+"\t")
+
+db = pwman.db.factory.create(params)
+db.open()
+try:
+    db.put("Foobar", "Foobar1Data")
+    db.put("Foobar1", "Foobar2Data")
+    db.put("Foobar2", "Foobar3Data")
+    db.put("Foobar3", "Foobar4Data")
+    db.put("Foobar4", "Foobar5Data")
+    db.put("Foobar5", "Foobar6Data")
+    
+    data = db.get("Foobar")
+    print "Data: " + data.__str__()
+    data = db.get("Foobar4")
+    print "Data: " + data.__str__()
+    data = db.get("Foobar2")
+    print "Data: " + data.__str__()
+
+    db.delete("Foobar1")
+    db.delete("Foobar3")
+
+    db.makelist("FoobarList1")
+    db.makelist("FoobarList2")
+    db.makelist("FoobarList3")
+    
+    db.changelist("FoobarList1")
+    db.put("FoobarSub", "FoobarSubData")
+    db.put("FoobarSub2", "FoobarSub2Data")
+    db.put("../FoobarSub", "Foobar")
+    db.makelist("SubSublist")
+    db.changelist("..")
+    db.changelist("/FoobarList1/SubSublist")
+    db.put("FoobarSub3", "FoobarSubData")
+    db.put("FoobarSub4", "FoobarSub2Data")
+    db.changelist("/")
+    
+    db.removelist("/FoobarList2")
+
+    try:
+        with db.transaction():
+            db.put("/FoobarList3/Undone", "Undone")
+            db.removelist("/FoobarList1", True)
+            db.delete("/Foobar")
+            raise DatabaseException("undo it")
+    except DatabaseException, e:
+        print "Rolled back: %s" % (e)
+    assert not db.exists("/FoobarList3/Undone")
+    assert db.get("/FoobarList1/SubSublist/FoobarSub3") == "FoobarSubData"
+    assert db.get("/Foobar") == "Foobar1Data"
+
+    # a nested block which fails fails the outer one, even if what it
+    # raised is caught
+    try:
+        with db.transaction():
+            db.put("/FoobarList3/Undone", "Undone")
+            try:
+                with db.transaction():
+                    db.delete("/Foobar")
+                    raise DatabaseException("undo it")
+            except DatabaseException, e:
+                pass
+    except DatabaseException, e:
+        print "Rolled back: %s" % (e)
+    assert not db.exists("/FoobarList3/Undone")
+    assert db.get("/Foobar") == "Foobar1Data"
+
+    # a move which is refused doesn't fail the transaction around it
+    with db.transaction():
+        db.put("/FoobarList3/Kept", "Kept")
+        try:
+            db.makelist("/FoobarList3/FoobarList1")
+            db.move("/FoobarList1", "/FoobarList3")
+        except DatabaseCopyException, e:
+            print "Refused: %s" % (e)
+        db.removelist("/FoobarList3/FoobarList1")
+    assert db.get("/FoobarList3/Kept") == "Kept"
+
+    # the current list is followed when it is moved
+    db.changelist("/FoobarList3")
+    db.move("/FoobarList3", "/FoobarList2")
+    db.put("Followed", "Followed")
+    assert str(db.get_currentlist()) == "/FoobarList2"
+    assert db.get("/FoobarList2/Followed") == "Followed"
+    db.changelist("/")
+
+    printlist("/")
+finally:
+    db.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# Measure the memory held by the nodes of a listed list, by the ids
+# the driver remembers for them, and by the DatabaseData objects read
+# back from it.
+#
+import os
+import sys
+import weakref
+import pwman.db.factory
+
+params = {'Database': {'type': 'SQLite',
+                       'filename':'/tmp/memory_bench.db'}
+          }
+
+entries = 100000
+
+def sizeof(obj, seen):
+    """Size of obj, its __dict__ or slots, the weak references to it,
+    and what they hold that hasn't been counted yet. Stops at other
+    nodes."""
+    if (id(obj) in seen):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    for ref in weakref.getweakrefs(obj):
+        size += sizeof(ref, seen)
+    values = []
+    if (hasattr(obj, '__dict__')):
+        size += sys.getsizeof(obj.__dict__)
+        values = obj.__dict__.values()
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            if (hasattr(obj, slot) and slot != '__weakref__'):
+                values.append(getattr(obj, slot))
+    for value in values:
+        if (isinstance(value, (str, unicode))):
+            size += sizeof(value, seen)
+    return size
+
+if os.path.exists(params['Database']['filename']):
+    os.remove(params['Database']['filename'])
+
+db = pwman.db.factory.create(params)
+db.open()
+try:
+    db.makelist("/big")
+    db.put_many([("/big/entry%d" % (i), "password%d" % (i))
+                 for i in range(entries)])
+
+    seen = set()
+    nodes = db.list("/big")
+    listed = sum([sizeof(n, seen) for n in nodes])
+    # the weak references are counted with the nodes
+    memo = db._nodeids.data
+    remembered = sys.getsizeof(memo) \
+                 + sum([sizeof(v, seen) for v in memo.values()])
+    named = sum([len(n.get_name()) for n in nodes])
+    seen = set()
+    after = sum([sizeof(n, seen) for n in nodes])
+    datas = [db._get(n) for n in nodes[:1000]]
+    seen = set()
+    data = sum([sizeof(d, seen) for d in datas])
+
+    print "%d nodes" % (len(nodes))
+    print "%-30s %8d bytes/node" % ("listed", listed / len(nodes))
+    print "%-30s %8d bytes/node" % ("remembered ids",
+                                    remembered / len(nodes))
+    print "%-30s %8d bytes/node" % ("after get_name()", after / len(nodes))
+    print "%-30s %8d bytes/object" % ("DatabaseData read", data / len(datas))
+finally:
+    db.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# Checks the SQLite driver with inmemory on writes the vault back on
+# flush(), on close and once flushinterval has passed, and only then.
+# Then times list and get on a list of n passwords, in memory and on
+# disk:
+#     sqlite_inmemory_test.py [n]
+#
+from pwman.db.database import DatabaseException
+import glob
+import os
+import sys
+import time
+import pwman.db.factory
+
+filename = '/tmp/test_inmemory.db'
+n = 10000
+if (len(sys.argv) > 1):
+    n = int(sys.argv[1])
+
+def create(inmemory, flushinterval=0):
+    db = pwman.db.factory.create({'Database': {'type': 'SQLite',
+                                               'filename': filename,
+                                               'inmemory': inmemory,
+                                               'flushinterval':
+                                               flushinterval}})
+    db.open()
+    return db
+
+def ondisk(path):
+    """Returns the data of path as it is in the file"""
+    db = create('no')
+    try:
+        if (not db.exists(path)):
+            return None
+        return db.get(path)
+    finally:
+        db.close()
+
+for f in glob.glob(filename + "*"):
+    os.remove(f)
+
+db = create('yes')
+db.put("Foobar", "Foobar1Data")
+db.close()
+assert ondisk("Foobar") == "Foobar1Data"
+
+db = create('yes')
+assert db.get("Foobar") == "Foobar1Data"
+db.put("Foobar", "Foobar2Data")
+assert ondisk("Foobar") == "Foobar1Data"
+db.flush()
+assert ondisk("Foobar") == "Foobar2Data"
+db.put("Foobar", "Foobar3Data")
+db.close()
+assert ondisk("Foobar") == "Foobar3Data"
+print "flush and close: ok"
+
+db = create('yes', 1)
+db.put("Foobar", "Foobar4Data")
+assert ondisk("Foobar") == "Foobar3Data"
+time.sleep(1)
+db.put("Foobar", "Foobar5Data")
+assert ondisk("Foobar") == "Foobar5Data"
+db.close()
+print "flushinterval: ok"
+
+db = create('no')
+db.makelist("/bench")
+db.put_many([("/bench/e%d" % (i), "password%d" % (i)) for i in range(n)])
+db.close()
+
+for inmemory in ['no', 'yes']:
+    db = create(inmemory)
+    try:
+        start = time.time()
+        db.list("/bench", limit=20)
+        listed = time.time() - start
+        start = time.time()
+        for i in range(1000):
+            db.get("/bench/e%d" % (i * n / 1000))
+        got = (time.time() - start) / 1000
+        print "inmemory=%s: list %.1fms, get %.1fus" % (inmemory,
+                                                         listed * 1000,
+                                                         got * 1000000)
+    finally:
+        db.close()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+#
+# Checks the SQLite schema migrations: a vault in the original layout
+# is upgraded when opened, and a migration which fails is rolled back
+# without leaving the vault locked.
+#
+from pwman.db.database import DatabaseException
+from pysqlite2 import dbapi2 as sqlite
+import glob
+import os
+import pwman.db.factory
+
+filename = '/tmp/test_migrate.db'
+params = {'Database': {'type': 'SQLite',
+                       'filename': filename}
+          }
+
+def oldvault():
+    """Create a vault in the layout from before schema versions"""
+    for f in glob.glob(filename + "*"):
+        os.remove(f)
+    con = sqlite.connect(filename)
+    con.executescript("""
+        CREATE TABLE NODES(ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            NODENAME TEXT NOT NULL, DATATYPE TEXT,
+            PARENT INT NOT NULL DEFAULT 0);
+        CREATE TABLE DATA(ID INTEGER NOT NULL PRIMARY KEY,
+            DATA BLOB NOT NULL);
+        CREATE TABLE KEYS(THEKEY TEXT NOT NULL DEFAULT '');
+        INSERT INTO KEYS VALUES('');""")
+    con.commit()
+    return con
+
+def version():
+    con = sqlite.connect(filename)
+    try:
+        return con.execute("SELECT VERSION FROM SCHEMAVERSION").fetchone()[0]
+    finally:
+        con.close()
+
+oldvault().close()
+db = pwman.db.factory.create(params)
+db.open()
+db.put("Foobar", "Foobar1Data")
+db.close()
+assert version() == 2
+print "upgraded: ok"
+
+# migration 1 rebuilds DATA through DATA_NEW, which is in the way
+con = oldvault()
+con.execute("CREATE TABLE DATA_NEW(ID INTEGER)")
+con.commit()
+con.close()
+db = pwman.db.factory.create(params)
+try:
+    db.open()
+    raise AssertionError("migration did not fail")
+except DatabaseException, e:
+    print "Failed: %s" % (e)
+assert version() == 0
+
+# another connection can still write to the vault
+con = sqlite.connect(filename, timeout=1)
+con.execute("INSERT INTO KEYS VALUES('')")
+con.commit()
+con.close()
+print "failed migration: ok"
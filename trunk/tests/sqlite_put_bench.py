@@ -0,0 +1,60 @@
+#!/usr/bin/python
+#
+# Count the statements SQLiteDatabase.put issues when creating a new
+# password and when overwriting an existing one, three lists deep.
+# "cold" starts with empty id caches, "warm" after the path has
+# been resolved once. "handle" puts through a handle from open_node.
+#
+import os
+import pwman.db.factory
+
+params = {'Database': {'type': 'SQLite',
+                       'filename':'/tmp/put_bench.db'}
+          }
+
+class CountingCursor:
+    """Wraps a cursor, counting the statements executed through it"""
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.count = 0
+
+    def execute(self, *args):
+        self.count += 1
+        return self.cursor.execute(*args)
+
+    def executemany(self, *args):
+        self.count += 1
+        return self.cursor.executemany(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+def count(db, path, cold):
+    if (cold):
+        db._idcache.clear()
+        db._forget()
+    db._cur.count = 0
+    db.put(path, "data")
+    return db._cur.count
+
+if os.path.exists(params['Database']['filename']):
+    os.remove(params['Database']['filename'])
+
+db = pwman.db.factory.create(params)
+db.open()
+try:
+    db.makelist("/a")
+    db.makelist("/a/b")
+    db.makelist("/a/b/c")
+    db._cur = CountingCursor(db._cur)
+
+    print "%-20s %10s" % ("operation", "statements")
+    print "%-20s %10d" % ("put-new cold", count(db, "/a/b/c/new1", True))
+    print "%-20s %10d" % ("put-new warm", count(db, "/a/b/c/new2", False))
+    print "%-20s %10d" % ("put-overwrite cold", count(db, "/a/b/c/new1", True))
+    print "%-20s %10d" % ("put-overwrite warm", count(db, "/a/b/c/new1", False))
+    handle = db.open_node("/a/b/c/new1")
+    print "%-20s %10d" % ("put-handle cold", count(db, handle, True))
+    print "%-20s %10d" % ("put-handle warm", count(db, handle, False))
+finally:
+    db.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+#
+# Compare cold path lookups in SQLiteDatabase: one query per level
+# against _resolve, which walks chains shorter than _shortchain the
+# same way and uses a single recursive query for longer ones.
+#
+from pwman.db.database import LIST
+import os
+import time
+import pwman.db.factory
+
+params = {'Database': {'type': 'SQLite',
+                       'filename':'/tmp/resolve_bench.db'}
+          }
+
+maxdepth = 32
+rounds = 200
+
+def walk(db, node):
+    """Resolve node one level at a time, like _get_parentid used to"""
+    chain = []
+    while (node != None):
+        chain.append(node)
+        node = node.get_parent()
+    chain.reverse()
+    id = 0
+    for n in chain:
+        db._cur.execute("SELECT ID FROM NODES WHERE"
+                        +" DATATYPE = ? AND NODENAME = ? AND PARENT = ?",
+                        (n.get_type(), n.get_cryptedname(), id))
+        id = db._cur.fetchone()[0]
+    return id
+
+def resolve(db, node):
+    # cold: neither the id cache nor the remembered ids know the path
+    db._idcache.clear()
+    db._forget()
+    return db._resolve(node)
+
+def timeit(func, db, node):
+    start = time.time()
+    for i in range(rounds):
+        func(db, node)
+    return (time.time() - start) / rounds * 1000000
+
+if os.path.exists(params['Database']['filename']):
+    os.remove(params['Database']['filename'])
+
+db = pwman.db.factory.create(params)
+db.open()
+try:
+    path = ""
+    for depth in range(1, maxdepth+1):
+        path = "%s/l%d" % (path, depth)
+        db.makelist(path)
+
+    print "%5s %12s %12s" % ("depth", "walk (us)", "resolve (us)")
+    path = ""
+    for depth in range(1, maxdepth+1):
+        path = "%s/l%d" % (path, depth)
+        node = db._buildnode(path, LIST)
+        assert walk(db, node) == resolve(db, node)
+        print "%5d %12.1f %12.1f" % (depth, timeit(walk, db, node),
+                                     timeit(resolve, db, node))
+finally:
+    db.close()
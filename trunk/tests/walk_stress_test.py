@@ -0,0 +1,100 @@
+#!/usr/bin/python
+#
+# Stress the iterative tree walk: a chain of lists 10k deep and a
+# tree of 1M nodes (1000 lists of 999 passwords).
+# Sizes can be given on the command line:
+#     walk_stress_test.py [depth] [lists] [passwords per list]
+#
+from __future__ import with_statement
+from pwman.db.database import Database, DatabaseNode, DatabaseData, LIST
+import os
+import sys
+import time
+import pwman.db.factory
+
+params = {'Database': {'type': 'SQLite',
+                       'filename':'/tmp/walk_stress.db'}
+          }
+
+depth = 10000
+lists = 1000
+perlist = 999
+if (len(sys.argv) > 1):
+    depth = int(sys.argv[1])
+if (len(sys.argv) > 3):
+    lists = int(sys.argv[2])
+    perlist = int(sys.argv[3])
+
+def timed(message, func, *args):
+    start = time.time()
+    result = func(*args)
+    print "%-40s %8.2fs" % (message, time.time() - start)
+    return result
+
+def generic(method, *args):
+    """Call the driver independent implementation of a hook,
+    in a transaction as Database does"""
+    with db.transaction():
+        method(db, *args)
+
+def count(iterator):
+    n = 0
+    for i in iterator:
+        n += 1
+    return n
+
+def makechain():
+    # built from nodes, as building each list from its path
+    # would be quadratic in the depth
+    node = None
+    with db.transaction():
+        for i in range(depth):
+            node = DatabaseNode("c%d" % (i), node, LIST)
+            db._makelist(node)
+        db._put(DatabaseNode("bottom", node), DatabaseData("bottom"))
+    return str(node)
+
+def maketree():
+    with db.transaction():
+        db.makelist("/tree")
+        for i in range(lists):
+            db.makelist("/tree/l%d" % (i))
+    db.put_many([("/tree/l%d/p%d" % (i, j), "data")
+                 for i in range(lists) for j in range(perlist)])
+
+if os.path.exists(params['Database']['filename']):
+    os.remove(params['Database']['filename'])
+
+db = pwman.db.factory.create(params)
+db.open()
+try:
+    print "chain of %d lists" % (depth)
+    path = timed("build", makechain)
+    node = db._buildnode(path + "/bottom")
+    assert str(node) == path + "/bottom"
+    assert timed("get bottom", db.get, path + "/bottom") == "bottom"
+    n = timed("walk pre", count, db.walk("/c0", 'pre'))
+    assert n == depth + 1
+    n = timed("walk post", count, db.walk("/c0", 'post'))
+    assert n == depth + 1
+    # the driver independent implementations built on walk
+    timed("copy (generic)", generic, Database._copytree,
+          db._buildnode("/c0", LIST), db._buildnode("/copy", LIST))
+    assert db.get("/copy" + path[len("/c0"):] + "/bottom") == "bottom"
+    timed("remove (generic)", generic, Database._removetree,
+          db._buildnode("/copy", LIST))
+    assert not db.exists("/copy", LIST)
+    timed("remove", db.removelist, "/c0", True)
+    assert not db.exists("/c0", LIST)
+
+    print "tree of %d nodes" % (lists * (perlist + 1) + 1)
+    timed("build", maketree)
+    n = timed("walk pre", count, db.walk("/tree", 'pre'))
+    assert n == lists * (perlist + 1) + 1
+    n = timed("walk post", count, db.walk("/tree", 'post'))
+    assert n == lists * (perlist + 1) + 1
+    timed("remove (generic)", generic, Database._removetree,
+          db._buildnode("/tree", LIST))
+    assert not db.exists("/tree", LIST)
+finally:
+    db.close()